@@ -18,66 +18,519 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import os
-import select
+import time
 
-from sensor_net_proxy.logger import logger, LoggerHelper, logging
-from sensor_net_proxy.my_sensors import MySensorsEthernetProxy
-from sensor_net_proxy.zmq_proxy import ZmqProxy
+from sensor_net_proxy.capture import CaptureWriter, CaptureReplayer
+from sensor_net_proxy.coalescer import Coalescer
+from sensor_net_proxy.engine import ENGINES
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.last_value_cache import LastValueCache, SnapshotServer
+from sensor_net_proxy.logger import logger, LoggerHelper, logging, SummaryLog
+from sensor_net_proxy.metrics import MetricsRegistry, MetricsServer, read_udp_errors
+from sensor_net_proxy.my_sensors import MySensorsEthernetProxy, MySensorsMsg
+from sensor_net_proxy.netwatch import InterfaceWatcher
+from sensor_net_proxy.ota import FirmwareStore, OtaServer
+from sensor_net_proxy.pipeline import BoundedQueue, PublisherThread
+from sensor_net_proxy.rate_limit import RateLimiter
+from sensor_net_proxy.responder import InternalResponder, NodeIdAllocator
+from sensor_net_proxy.spool import SegmentLog, ReplayServer
+from sensor_net_proxy.zmq_proxy import ZmqProxy, publisher_socket_options
 
 
 class Application(object):
 
-    def __init__(self, cli_conf=None):
+    # number of seconds between runs of periodic maintenance tasks
+    HOUSEKEEPING_INTERVAL = 1.0
+    # number of seconds to wait for the publisher thread to publish the queued messages on exit
+    PUBLISHER_STOP_TIMEOUT = 5.0
+    # number of seconds between checks for datagrams due to be replayed with the original timing
+    REPLAY_INTERVAL = 0.001
+    # number of seconds to wait before replaying, so subscribers can connect
+    REPLAY_START_DELAY = 1.0
+
+    def __init__(self, cli_conf=None, worker_id=None, publish_endpoint=None):
         """
         Initialize the application
 
         :param cli_conf: ArgsParser object with configuration gathered from commandline
+        :param worker_id: number of the worker process or None if running as a single process
+        :param publish_endpoint: endpoint of the workers' forwarder to connect the publisher socket to
         :return:
         """
         self._conf = cli_conf
-        self._debug_log_file = self._add_debug_log_file()
+        self._worker_id = worker_id
+        self._publish_endpoint = publish_endpoint
+        self._mysensors_proxy = None
+        self._zmq_proxy = None
+        self._engine = None
+        self._publish_queue = None
+        self._publisher = None
+        self._reported_drops = 0
+        self._reported_rejects = 0
+        self._reported_rate_limited = 0
+        self._coalescer = None
+        self._last_value_cache = None
+        self._snapshot_server = None
+        self._spool = None
+        self._replay_server = None
+        self._capture = None
+        self._ota_server = None
+        self._interface_watcher = None
+        self._responder = None
+        self._capture_replayer = None
+        self._replay_start = None
+        self._metrics = MetricsRegistry()
+        self._metrics_server = None
+        self._latency = self._metrics.histogram('receive_to_publish_seconds',
+                                                'Time from receiving messages from gateways to publishing them')
+        self._summary_log = SummaryLog(logger, self._conf.log_summary_interval, self._conf.log_summary_every)
 
-        if self._conf.verbose:
-            LoggerHelper.add_stream_handler(logger, logging.DEBUG)
-        else:
-            LoggerHelper.add_stream_handler(logger, logging.INFO)
+        console_level = logging.DEBUG if self._conf.verbose else logging.INFO
+        LoggerHelper.add_stream_handler(logger, console_level)
 
-        self._add_debug_log_file()
+        self._debug_log_file = None
+        if self._conf.debug_log:
+            self._debug_log_file = self._add_debug_log_file()
+        if self._debug_log_file is None:
+            # skip creating records of debug messages nobody would see
+            logger.setLevel(console_level)
 
     def _add_debug_log_file(self):
         """
         Add the application wide debug log file
         :return:
         """
-        debug_log_file = os.path.join(os.getcwd(), 'sensor-net-proxy-debug.log')
+        if self._worker_id is None:
+            debug_log_file = os.path.join(os.getcwd(), 'sensor-net-proxy-debug.log')
+        else:
+            debug_log_file = os.path.join(os.getcwd(), 'sensor-net-proxy-debug-{0}.log'.format(self._worker_id))
         try:
-            LoggerHelper.add_file_handler(logger,
-                                          debug_log_file,
-                                          logging.Formatter("%(asctime)s %(levelname)s %(message)s"),
-                                          logging.DEBUG)
+            LoggerHelper.add_queued_file_handler(logger,
+                                                 debug_log_file,
+                                                 logging.Formatter("%(asctime)s %(levelname)s %(message)s"),
+                                                 logging.DEBUG)
         except (IOError, OSError):
             logger.warning("Can not create debug log '{0}'".format(debug_log_file))
         else:
             return debug_log_file
 
+    def _is_control_process(self):
+        """
+        Only a single process handles dynamic discovery and commands from controllers,
+        so the gateway registry is kept in one place.
+        """
+        return self._worker_id is None or self._worker_id == 0
+
     def run(self):
-        logger.info('Sensor Net Proxy staring')
+        if self._worker_id is None:
+            logger.info('Sensor Net Proxy staring')
+        else:
+            logger.info('Sensor Net Proxy worker {0} staring'.format(self._worker_id))
 
-        mysensors_proxy = MySensorsEthernetProxy(self._conf.interface, self._conf.port, self._conf.dynamic_discovery)
-        zmq_proxy = ZmqProxy()
+        control = self._is_control_process()
+        rate_limiter = None
+        if self._conf.rate_limit > 0:
+            rate_limiter = RateLimiter(self._conf.rate_limit, self._conf.rate_limit_burst,
+                                       self._conf.rate_limit_max_sources)
+        discovery_rate_limiter = None
+        if self._conf.discovery_rate_limit > 0:
+            discovery_rate_limiter = RateLimiter(self._conf.discovery_rate_limit,
+                                                 self._conf.discovery_rate_limit_burst,
+                                                 self._conf.rate_limit_max_sources)
+        gateway_ttl = self._conf.gateway_ttl
+        if self._worker_id is not None:
+            # other workers do not report messages of gateways to the control process, so gateways
+            # whose messages land on them would expire although they are alive
+            gateway_ttl = None
+            if control:
+                logger.info('Gateways do not expire with multiple workers')
+        self._mysensors_proxy = MySensorsEthernetProxy(self._conf.listen_specs,
+                                                       self._conf.dynamic_discovery and control,
+                                                       self._conf.recv_batch_size,
+                                                       self._conf.route_ttl, self._conf.route_max_size,
+                                                       gateway_ttl, self._conf.gateway_max_size,
+                                                       self._conf.check_sub_type, self._conf.quarantine_size,
+                                                       rate_limiter, discovery_rate_limiter)
+        if self._publish_endpoint is None:
+            publish_endpoints, publish_connect = self._conf.zmq_publish_endpoints, False
+        else:
+            publish_endpoints, publish_connect = [self._publish_endpoint], True
+        if self._conf.spool_dir:
+            self._spool = SegmentLog(self._conf.spool_dir, self._conf.spool_segment_size * 1024 * 1024,
+                                     self._conf.spool_retention)
+        self._zmq_proxy = ZmqProxy(self._conf.zmq_format, self._conf.zmq_topic,
+                                   self._conf.zmq_command_endpoint if control else None,
+                                   self._conf.zmq_command_socket, self._conf.recv_batch_size,
+                                   publish_endpoints, publish_connect, self._spool,
+                                   self._conf.zmq_io_threads, publisher_socket_options(
+                                       self._conf.zmq_sndhwm, self._conf.zmq_sndbuf, self._conf.zmq_tcp_keepalive,
+                                       self._conf.zmq_tcp_keepalive_idle, self._conf.zmq_tcp_keepalive_interval,
+                                       self._conf.zmq_conflate), self._conf.check_sub_type)
+        self._engine = ENGINES[self._conf.engine]()
+        logger.debug("Using '{0}' engine".format(self._engine.name))
 
         try:
-            sockets = mysensors_proxy.get_sockets()
+            if self._conf.pipeline:
+                self._publish_queue = BoundedQueue(self._conf.queue_size, self._conf.queue_overflow)
+                self._publisher = PublisherThread(self._publish_queue, self._zmq_proxy,
+                                                  self._conf.publish_batch_size, self._latency)
+                self._publisher.start()
+
+            if self._conf.coalesce_window > 0:
+                self._coalescer = Coalescer(self._conf.coalesce_window, self._conf.coalesce_mode,
+                                            self._conf.coalesce_max_entries)
+                self._engine.call_periodically(self._conf.coalesce_window / 2, self._flush_coalescer)
+
+            if self._conf.snapshot_endpoint:
+                self._last_value_cache = LastValueCache(self._conf.lvc_max_entries)
+                self._snapshot_server = SnapshotServer(self._zmq_proxy.context, self._conf.snapshot_endpoint,
+                                                       self._last_value_cache, self._zmq_proxy.encoding)
+                for s in self._snapshot_server.get_sockets():
+                    self._engine.add_reader(s, self._snapshot_server.handle_requests)
+
+            if self._spool is not None:
+                self._engine.call_periodically(self._conf.spool_flush_interval, self._spool.flush)
+                if self._conf.replay_endpoint:
+                    self._replay_server = ReplayServer(self._zmq_proxy.context, self._conf.replay_endpoint,
+                                                       self._spool, self._conf.replay_batch_size)
+                    for s in self._replay_server.get_sockets():
+                        self._engine.add_reader(s, self._replay_server.handle_requests)
+
+            if self._conf.firmware_dir:
+                self._ota_server = OtaServer(FirmwareStore(self._conf.firmware_dir, self._conf.firmware_cache_size))
+
+            if self._conf.local_responder:
+                self._responder = InternalResponder(NodeIdAllocator(self._conf.node_id_file), self._conf.node_config)
+
+            if self._conf.capture_file:
+                self._capture = CaptureWriter(self._conf.capture_file)
+                self._mysensors_proxy.capture = self._capture
+            if self._conf.replay_capture:
+                self._capture_replayer = CaptureReplayer(self._conf.replay_capture, self._conf.replay_speed,
+                                                         self._mysensors_proxy.recv_batch_size)
+                logger.info("Replaying capture '{0}'".format(self._conf.replay_capture))
+                self._replay_start = time.monotonic() + self.REPLAY_START_DELAY
+                self._engine.call_periodically(self.REPLAY_INTERVAL if self._conf.replay_speed > 0 else 0,
+                                               self._replay_capture)
+
+            for s in self._mysensors_proxy.get_sockets():
+                self._add_listening_socket(s)
+            if self._conf.interface_watch != 'off':
+                self._interface_watcher = InterfaceWatcher(self._engine, self._update_listening_sockets,
+                                                           self._conf.interface_poll_interval,
+                                                           self._conf.interface_watch == 'auto')
+            for s in self._zmq_proxy.get_sockets():
+                self._engine.add_reader(s, self._on_command_readable)
+            self._engine.call_periodically(self.HOUSEKEEPING_INTERVAL, self._housekeeping)
+
+            if self._conf.metrics_endpoint:
+                self._register_metrics()
+                self._metrics_server = self._create_metrics_server(self._conf.metrics_endpoint)
+                self._metrics_server.start()
+
+            self._engine.run()
+        finally:
+            self._engine.close()
+            if self._metrics_server is not None:
+                self._metrics_server.stop()
+            # the ZMQ proxy and the spool are used by the publisher thread, they must not be closed under it
+            publisher_stopped = True
+            if self._publisher is not None:
+                publisher_stopped = self._publisher.stop(self.PUBLISHER_STOP_TIMEOUT)
+                if not publisher_stopped:
+                    logger.warning("Publisher thread did not stop in {0} seconds, leaving its sockets "
+                                   "and the spool open".format(self.PUBLISHER_STOP_TIMEOUT))
+            if self._snapshot_server is not None:
+                self._snapshot_server.close()
+            if self._replay_server is not None:
+                self._replay_server.close()
+            if self._spool is not None and publisher_stopped:
+                self._spool.close()
+            if self._capture is not None:
+                self._capture.close()
+            if self._responder is not None:
+                self._responder.save()
+            if self._capture_replayer is not None:
+                self._capture_replayer.close()
+            if self._interface_watcher is not None:
+                self._interface_watcher.close()
+            self._mysensors_proxy.close_sockets()
+            if publisher_stopped:
+                self._zmq_proxy.close_sockets()
 
+    def _create_metrics_server(self, endpoint):
+        """
+        Create server of the metrics endpoint given as 'address:port'. Workers listen on
+        consecutive ports starting with the given one.
+        """
+        address, _, port = endpoint.rpartition(':')
+        try:
+            port = int(port)
+        except ValueError:
+            raise SensorNetProxyError("Invalid metrics endpoint '{0}', expected 'address:port'".format(endpoint))
+        if self._worker_id is not None:
+            port += self._worker_id
+        return MetricsServer(self._metrics, address, port, {'/quarantine': self._render_quarantine})
+
+    def _render_quarantine(self):
+        """
+        Return text with the last rejected datagrams, one per line
+        """
+        lines = []
+        for timestamp, client, raw_msg, reason in self._mysensors_proxy.get_quarantine():
+            lines.append('{0} {1}:{2} {3} {4!r}'.format(
+                time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(timestamp)), client[0], client[1], reason, raw_msg))
+        return '\n'.join(lines) + '\n'
+
+    def _register_metrics(self):
+        """
+        Register metrics reading statistics of the application components
+        """
+        metrics = self._metrics
+        mysensors = self._mysensors_proxy
+        zmq_proxy = self._zmq_proxy
+        metrics.counter('datagrams_received_total', 'Datagrams received from gateways',
+                        lambda: mysensors.datagrams_received)
+        metrics.counter('bytes_received_total', 'Bytes received from gateways',
+                        lambda: mysensors.bytes_received)
+        metrics.counter('messages_received_total', 'Messages received from gateways by message type',
+                        lambda: {(MySensorsMsg.msg_type_to_str(t),): n for t, n in
+                                 list(mysensors.messages_received.items())},
+                        ('type',))
+        metrics.counter('messages_rejected_total', 'Datagrams from gateways rejected as malformed by reason',
+                        lambda: {(reason,): n for reason, n in list(mysensors.rejected.items())},
+                        ('reason',))
+        metrics.counter('rate_limited_total', 'Datagrams dropped by rate limiting of their source',
+                        lambda: {(kind,): limiter.rejected for kind, limiter in
+                                 (('messages', mysensors.rate_limiter), ('discovery', mysensors.discovery_rate_limiter))
+                                 if limiter is not None},
+                        ('kind',))
+        metrics.counter('discovery_requests_total', 'Dynamic discovery requests',
+                        lambda: mysensors.discovery_requests)
+        metrics.counter('datagrams_sent_total', 'Datagrams sent to gateways',
+                        lambda: mysensors.datagrams_sent)
+        metrics.counter('bytes_sent_total', 'Bytes sent to gateways',
+                        lambda: mysensors.bytes_sent)
+        metrics.gauge('gateways', 'Known gateways',
+                      lambda: mysensors.get_gateway_stats()['size'])
+        metrics.counter('gateways_added_total', 'Gateways added to the registry',
+                        lambda: mysensors.get_gateway_stats()['added'])
+        metrics.counter('gateways_removed_total', 'Gateways removed from the registry by reason',
+                        lambda: {('expired',): mysensors.get_gateway_stats()['expired'],
+                                 ('evicted',): mysensors.get_gateway_stats()['evicted']},
+                        ('reason',))
+        metrics.gauge('routes', 'Nodes with known gateway', mysensors.get_route_count)
+        metrics.gauge('listening_sockets', 'Sockets listening for messages from gateways',
+                      lambda: len(mysensors.get_sockets()))
+        metrics.counter('messages_published_total', 'Messages published to controllers',
+                        lambda: zmq_proxy.published)
+        metrics.counter('bytes_published_total', 'Bytes of published message bodies',
+                        lambda: zmq_proxy.bytes_published)
+        metrics.counter('commands_received_total', 'Messages received from controllers',
+                        lambda: zmq_proxy.commands_received)
+        metrics.counter('commands_malformed_total', 'Malformed messages received from controllers',
+                        lambda: zmq_proxy.commands_malformed)
+        if self._publish_queue is not None:
+            queue = self._publish_queue
+            metrics.gauge('publish_queue_length', 'Messages waiting to be published', lambda: len(queue))
+            metrics.counter('publish_queue_dropped_total', 'Messages dropped because the publish queue was full',
+                            lambda: queue.dropped)
+        if self._coalescer is not None:
+            coalescer = self._coalescer
+            metrics.counter('coalesced_total', 'Messages suppressed by coalescing', lambda: coalescer.suppressed)
+        if self._last_value_cache is not None:
+            cache = self._last_value_cache
+            metrics.gauge('last_values', 'Messages in the last value cache', lambda: len(cache))
+        if self._spool is not None:
+            spool = self._spool
+            metrics.gauge('spool_first_offset', 'Offset of the first retained message in the spool',
+                          lambda: spool.first_offset)
+            metrics.gauge('spool_next_offset', 'Offset of the next message appended to the spool',
+                          lambda: spool.next_offset)
+        if self._ota_server is not None:
+            ota_server = self._ota_server
+            metrics.counter('firmware_responses_total', 'Firmware requests answered by the proxy by request type',
+                            lambda: {('config',): ota_server.config_responses, ('block',): ota_server.block_responses},
+                            ('request',))
+        if self._responder is not None:
+            responder = self._responder
+            metrics.counter('internal_responses_total', 'Internal requests answered by the proxy by request type',
+                            lambda: {(MySensorsMsg.msg_internal_type_to_str(t),): n for t, n in
+                                     list(responder.responses.items())},
+                            ('request',))
+        metrics.counter('udp_errors_total', 'System wide UDP errors, e.g. datagrams dropped by the kernel',
+                        read_udp_errors, ('counter',))
+
+    def _housekeeping(self):
+        """
+        Periodic maintenance tasks
+        """
+        self._mysensors_proxy.expire()
+        self._summary_log.tick()
+        if self._capture is not None:
+            self._capture.flush()
+        if self._responder is not None:
+            self._responder.save()
+        if self._ota_server is not None:
+            self._ota_server.refresh()
+
+        if self._publish_queue is not None and self._publish_queue.dropped > self._reported_drops:
+            logger.warning("Publish queue is full, dropped {0} messages ({1} in total)".format(
+                self._publish_queue.dropped - self._reported_drops, self._publish_queue.dropped))
+            self._reported_drops = self._publish_queue.dropped
+
+        rate_limited = sum(limiter.rejected for limiter in (self._mysensors_proxy.rate_limiter,
+                                                           self._mysensors_proxy.discovery_rate_limiter)
+                           if limiter is not None)
+        if rate_limited > self._reported_rate_limited:
+            logger.warning("Rate limiting dropped {0} messages ({1} in total)".format(
+                rate_limited - self._reported_rate_limited, rate_limited))
+            self._reported_rate_limited = rate_limited
+
+        rejected = sum(self._mysensors_proxy.rejected.values())
+        if rejected > self._reported_rejects:
+            logger.warning("Rejected {0} malformed messages ({1} in total)".format(
+                rejected - self._reported_rejects, rejected))
+            quarantine = self._mysensors_proxy.get_quarantine()
+            if quarantine:
+                _, client, raw_msg, reason = quarantine[-1]
+                logger.warning("The last rejected message {0!r} from '{1}': {2}".format(raw_msg, client, reason))
+            self._reported_rejects = rejected
+
+    def _flush_coalescer(self):
+        """
+        Publish messages whose coalescing window closed
+        """
+        msgs = self._coalescer.flush()
+        if msgs:
+            self._publish(msgs)
+
+    def _publish(self, msgs, received_at=None):
+        """
+        Publish messages directly or pass them to the publisher thread in the pipelined mode.
+
+        :param msgs: list of MySensorsMsg
+        :param received_at: time.monotonic() time when the messages were received, None if not known
+        """
+        if self._last_value_cache is not None:
+            self._last_value_cache.update(msgs)
+
+        if self._publish_queue is not None:
+            self._publish_queue.put_many([(msg, received_at) for msg in msgs])
+        else:
+            for msg in msgs:
+                self._zmq_proxy.publish(msg)
+            if received_at is not None and msgs:
+                self._latency.observe_many(time.monotonic() - received_at, len(msgs))
+
+    def _add_listening_socket(self, sock):
+        if self._mysensors_proxy.is_socket_broadcast(sock):
+            self._engine.add_reader(sock, self._on_discovery_readable)
+        else:
+            self._engine.add_reader(sock, self._on_gateway_readable)
+
+    def _update_listening_sockets(self):
+        """
+        Follow changes of addresses of the interfaces the proxy listens on
+        """
+        self._mysensors_proxy.update_listening_sockets(self._add_listening_socket, self._engine.remove_reader)
+
+    def _on_discovery_readable(self, sock):
+        """
+        Handle all dynamic discovery requests queued on the broadcast socket.
+        """
+        try:
             while True:
-                ready_r, ready_w, _ = select.select(sockets, [], [])
-                for s in ready_r:
-                    if mysensors_proxy.is_socket_broadcast(s):
-                        mysensors_proxy.handle_dynamic_discovery(s)
+                self._mysensors_proxy.handle_dynamic_discovery(sock)
+        except BlockingIOError:
+            pass
+
+    def _on_gateway_readable(self, sock):
+        """
+        Publish all messages queued on the gateway listening socket.
+        """
+        batch_size = self._mysensors_proxy.recv_batch_size
+        while True:
+            received_at = time.monotonic()
+            msgs = self._mysensors_proxy.handle_incoming_msg(sock)
+            self._handle_gateway_msgs(msgs, received_at, sock)
+            if len(msgs) < batch_size:
+                break
+
+    def _handle_gateway_msgs(self, msgs, received_at, sock=None):
+        """
+        Publish messages received from gateways
+
+        :param msgs: list of (MySensorsMsg, client) tuples
+        :param received_at: time.monotonic() time when the messages were received
+        :param sock: socket on which the messages were received, None if they are replayed from a capture
+        """
+        if self._ota_server is not None or self._responder is not None:
+            to_publish = self._answer_locally([(msg, client, sock) for msg, client in msgs])
+        else:
+            to_publish = [msg for msg, _ in msgs]
+        if self._coalescer is not None:
+            to_publish = self._coalescer.process(to_publish)
+        self._publish(to_publish, received_at)
+        self._summary_log.add('received from gateways', len(msgs))
+
+    def _answer_locally(self, msgs):
+        """
+        Answer requests of nodes which are handled by the proxy itself
+
+        :param msgs: list of (MySensorsMsg, client, socket) tuples, the socket is None for replayed messages
+        :return: list of MySensorsMsg which should be forwarded to controllers
+        """
+        forward = []
+        for msg, client, sock in msgs:
+            if self._responder is not None:
+                # the ID response goes only to the requesting gateway, replayed requests are left to controllers
+                response = self._responder.handle(msg, assign_id=sock is not None)
+                if response is not None:
+                    if response.sub_type == MySensorsMsg.INTERNAL_TYPE_ID_RESPONSE:
+                        self._mysensors_proxy.send_msg_to_client(response, client, sock)
                     else:
-                        msg, client = mysensors_proxy.handle_incoming_msg(s)
-                        zmq_proxy.publish(msg)
-        finally:
-            mysensors_proxy.close_sockets()
-            zmq_proxy.close_sockets()
+                        self._mysensors_proxy.send_msg_to_gateway(response)
+                    continue
+            if self._ota_server is not None and msg.message_type == MySensorsMsg.MSG_TYPE_STREAM:
+                response = self._ota_server.handle(msg)
+                if response is not None:
+                    self._mysensors_proxy.send_serial_to_gateway(msg.node_id, response)
+                    continue
+            forward.append(msg)
+        return forward
+
+    def _replay_capture(self):
+        """
+        Feed the datagrams due to be replayed through the same path as the received ones.
+        Stops the application at the end of the capture.
+        """
+        if time.monotonic() < self._replay_start:
+            return
+        replayer = self._capture_replayer
+        while True:
+            received_at = time.monotonic()
+            datagrams = replayer.next_batch()
+            if datagrams is None:
+                logger.info("Replayed {0} datagrams in {1:.3f} s".format(replayer.replayed, replayer.elapsed))
+                self._engine.stop()
+                return
+            if not datagrams:
+                return
+            self._handle_gateway_msgs(self._mysensors_proxy.handle_datagrams(datagrams), received_at)
+            # when replaying as fast as possible, let the engine handle other sockets between batches
+            if self._conf.replay_speed <= 0 or len(datagrams) < self._mysensors_proxy.recv_batch_size:
+                return
 
+    def _on_command_readable(self, sock):
+        """
+        Send all messages queued on the ZMQ command socket to the gateways.
+        """
+        batch_size = self._zmq_proxy.command_batch_size
+        while True:
+            msgs = self._zmq_proxy.handle_incoming_msg(sock)
+            for msg in msgs:
+                self._mysensors_proxy.send_msg_to_gateway(msg)
+            self._summary_log.add('sent to gateways', len(msgs))
+            if len(msgs) < batch_size:
+                break
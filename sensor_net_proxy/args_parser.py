@@ -18,17 +18,98 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import argparse
+import configparser
+
+from sensor_net_proxy.coalescer import Coalescer
+from sensor_net_proxy.encoding import ENCODINGS
+from sensor_net_proxy.engine import ENGINES
+from sensor_net_proxy.netwatch import InterfaceWatcher
+from sensor_net_proxy.pipeline import BoundedQueue
+from sensor_net_proxy.responder import InternalResponder
+from sensor_net_proxy.zmq_proxy import ZmqProxy
+
+
+def listen_spec(value):
+    """
+    Parse the 'interface:port' listen spec, the port is optional
+    """
+    interface, _, port = value.partition(':')
+    if not interface:
+        raise argparse.ArgumentTypeError("Missing interface in '{0}'".format(value))
+    if not port:
+        return interface, None
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid port in '{0}'".format(value))
+    if not 0 < port < 65536:
+        raise argparse.ArgumentTypeError("Invalid port in '{0}'".format(value))
+    return interface, port
 
 
 class ArgsParser(object):
     """ Class for processing data from commandline """
 
+    # section of the config file with the options
+    CONFIG_SECTION = 'sensor-net-proxy'
+
     def __init__(self, args=None):
         """ parse arguments """
         self.parser = argparse.ArgumentParser(description='Simple sensors network <-> controller proxy',
                                               formatter_class=argparse.ArgumentDefaultsHelpFormatter)
         self.add_args()
+        # values of repeatable options from the config file, used only if not given on the commandline
+        self._config_lists = {}
+        config = self.parser.parse_known_args(args)[0].config
+        if config:
+            self.load_config(config)
         self.args = self.parser.parse_args(args)
+        for dest, value in self._config_lists.items():
+            if getattr(self.args, dest) is None:
+                setattr(self.args, dest, value)
+
+    def load_config(self, path):
+        """
+        Use values from the config file as defaults of the options, so the commandline overrides them.
+
+        The file is in the INI format with the options in the 'sensor-net-proxy' section. Keys are the long
+        option names without the leading dashes, e.g. 'zmq-sndhwm = 10000'. Flags which turn a feature off,
+        e.g. --no-zmq-topic, are set as 'zmq-topic = no'. Repeatable options take whitespace separated values.
+        """
+        config = configparser.ConfigParser(interpolation=None)
+        try:
+            with open(path) as f:
+                config.read_file(f)
+        except (IOError, OSError, configparser.Error) as e:
+            self.parser.error("Can not read config file '{0}': {1}".format(path, e))
+        if not config.has_section(ArgsParser.CONFIG_SECTION):
+            self.parser.error("Config file '{0}' has no [{1}] section".format(path, ArgsParser.CONFIG_SECTION))
+
+        actions = dict((action.dest, action) for action in self.parser._actions)
+        section = config[ArgsParser.CONFIG_SECTION]
+        defaults = {}
+        for key in section:
+            dest = key.replace('-', '_')
+            action = actions.get(dest)
+            if action is None or dest in ('help', 'config'):
+                self.parser.error("Unknown option '{0}' in config file '{1}'".format(key, path))
+            try:
+                if isinstance(action, (argparse._StoreTrueAction, argparse._StoreFalseAction)):
+                    value = section.getboolean(key)
+                elif isinstance(action, argparse._AppendAction):
+                    # as a default, argparse would append the commandline values to it
+                    self._config_lists[dest] = [action.type(v) if action.type else v for v in section[key].split()]
+                    continue
+                else:
+                    # converted by argparse using the type of the option
+                    value = section[key]
+            except (ValueError, argparse.ArgumentTypeError) as e:
+                self.parser.error("Invalid value of '{0}' in config file '{1}': {2}".format(key, path, e))
+            if action.choices is not None and value not in action.choices:
+                self.parser.error("Invalid value of '{0}' in config file '{1}', choose from {2}".format(
+                    key, path, ', '.join(str(choice) for choice in action.choices)))
+            defaults[dest] = value
+        self.parser.set_defaults(**defaults)
 
     def add_args(self):
         self.parser.add_argument(
@@ -38,6 +119,38 @@ class ArgsParser(object):
             action='store_true',
             help='Output is more verbose'
         )
+        self.parser.add_argument(
+            '-c',
+            '--config',
+            default=None,
+            help='INI file with values of the options in the [sensor-net-proxy] section, '
+                 'e.g. zmq-sndhwm = 10000. Options given on the commandline take precedence'
+        )
+        self.parser.add_argument(
+            '--no-debug-log',
+            default=True,
+            action='store_false',
+            dest='debug_log',
+            help='Do not write the debug log file into the current directory'
+        )
+        self.parser.add_argument(
+            '--log-summary-interval',
+            default=60.0,
+            type=float,
+            help='Number of seconds between log lines summarizing handled messages, 0 to disable'
+        )
+        self.parser.add_argument(
+            '--log-summary-every',
+            default=0,
+            type=int,
+            help='Number of handled messages between log lines summarizing them, 0 to disable'
+        )
+        self.parser.add_argument(
+            '--metrics-endpoint',
+            default=None,
+            help='Address and port of the HTTP endpoint exposing metrics in the Prometheus text format, '
+                 'e.g. 127.0.0.1:9108. Workers listen on consecutive ports'
+        )
         self.parser.add_argument(
             '-i',
             '--interface',
@@ -50,6 +163,28 @@ class ArgsParser(object):
             default=5003,
             help='Port on which to listen'
         )
+        self.parser.add_argument(
+            '--listen',
+            default=None,
+            action='append',
+            type=listen_spec,
+            metavar='INTERFACE[:PORT]',
+            help='Interface and port on which to listen, can be given multiple times. The port defaults to --port. '
+                 'Replaces --interface'
+        )
+        self.parser.add_argument(
+            '--interface-watch',
+            default='auto',
+            choices=InterfaceWatcher.MODES,
+            help='How to follow changes of addresses of the interfaces. auto uses rtnetlink where available '
+                 'and polling otherwise'
+        )
+        self.parser.add_argument(
+            '--interface-poll-interval',
+            default=5.0,
+            type=float,
+            help='Number of seconds between checks of addresses of the interfaces when polling'
+        )
         self.parser.add_argument(
             '--no-dynamic-discovery',
             default=True,
@@ -57,6 +192,321 @@ class ArgsParser(object):
             dest='dynamic_discovery',
             help='Whether to turn off dynamic discovery (means listening also on interface subnet broadcast address)'
         )
+        self.parser.add_argument(
+            '--engine',
+            default='select',
+            choices=sorted(ENGINES),
+            help='Engine used for waiting on sockets. The asyncio engine uses epoll where available'
+        )
+        self.parser.add_argument(
+            '--workers',
+            default=1,
+            type=int,
+            help='Number of worker processes receiving messages from gateways'
+        )
+        self.parser.add_argument(
+            '--pipeline',
+            default=False,
+            action='store_true',
+            help='Publish messages from a separate thread, so slow publishing does not stall receiving'
+        )
+        self.parser.add_argument(
+            '--queue-size',
+            default=10000,
+            type=int,
+            help='Maximum number of messages waiting for the publisher thread in the pipelined mode'
+        )
+        self.parser.add_argument(
+            '--queue-overflow',
+            default=BoundedQueue.DROP_OLDEST,
+            choices=BoundedQueue.POLICIES,
+            help='What to do with messages when the queue of the publisher thread is full'
+        )
+        self.parser.add_argument(
+            '--publish-batch-size',
+            default=64,
+            type=int,
+            help='Maximum number of messages the publisher thread takes from the queue at once'
+        )
+        self.parser.add_argument(
+            '--coalesce-window',
+            default=0,
+            type=float,
+            help='Number of seconds for which repeated SET messages with unchanged payload are not published. '
+                 'Zero turns the coalescing off'
+        )
+        self.parser.add_argument(
+            '--coalesce-mode',
+            default=Coalescer.IMMEDIATE,
+            choices=Coalescer.MODES,
+            help='Whether SET messages with changed payload are published immediately, or only the last one '
+                 'when the coalescing window closes'
+        )
+        self.parser.add_argument(
+            '--coalesce-max-entries',
+            default=4096,
+            type=int,
+            help='Maximum number of sensor values tracked for coalescing'
+        )
+        self.parser.add_argument(
+            '--snapshot-endpoint',
+            default=None,
+            help='ZMQ endpoint on which to serve snapshots of the last published values, e.g. tcp://*:5558'
+        )
+        self.parser.add_argument(
+            '--lvc-max-entries',
+            default=65536,
+            type=int,
+            help='Maximum number of last values kept for snapshots'
+        )
+        self.parser.add_argument(
+            '--spool-dir',
+            default=None,
+            help='Directory of the on-disk spool of published messages, spooling is disabled if not given'
+        )
+        self.parser.add_argument(
+            '--spool-segment-size',
+            default=16,
+            type=int,
+            help='Size of a spool segment file in MiB'
+        )
+        self.parser.add_argument(
+            '--spool-retention',
+            default=16,
+            type=int,
+            help='Number of spool segment files to keep'
+        )
+        self.parser.add_argument(
+            '--spool-flush-interval',
+            default=1.0,
+            type=float,
+            help='Number of seconds between syncs of the spool to the disk'
+        )
+        self.parser.add_argument(
+            '--replay-endpoint',
+            default=None,
+            help='ZMQ endpoint on which to serve messages from the spool starting with a given offset, '
+                 'e.g. tcp://*:5559'
+        )
+        self.parser.add_argument(
+            '--replay-batch-size',
+            default=1000,
+            type=int,
+            help='Maximum number of messages in a single reply of the replay endpoint'
+        )
+        self.parser.add_argument(
+            '--local-responder',
+            default=False,
+            action='store_true',
+            help='Answer time, config and node ID requests of nodes in the proxy instead of controllers'
+        )
+        self.parser.add_argument(
+            '--node-id-file',
+            default='sensor-net-proxy-node-ids.json',
+            help='File storing node IDs which are in use, for assigning IDs by the local responder'
+        )
+        self.parser.add_argument(
+            '--node-config',
+            default=InternalResponder.UNIT_METRIC,
+            choices=InternalResponder.UNITS,
+            help='Unit system sent to nodes asking for config by the local responder'
+        )
+        self.parser.add_argument(
+            '--firmware-dir',
+            default=None,
+            help='Directory with firmware images named <type>-<version>.bin, from which the proxy answers '
+                 'firmware requests of nodes. The requests are forwarded to controllers if not given'
+        )
+        self.parser.add_argument(
+            '--firmware-cache-size',
+            default=8,
+            type=int,
+            help='Maximum number of firmware images kept in memory'
+        )
+        self.parser.add_argument(
+            '--capture-file',
+            default=None,
+            help='File to record the datagrams received from gateways into'
+        )
+        self.parser.add_argument(
+            '--replay-capture',
+            default=None,
+            help='Capture file to replay as if the datagrams were received from gateways, '
+                 'the proxy exits at the end of the capture'
+        )
+        self.parser.add_argument(
+            '--replay-speed',
+            default=1.0,
+            type=float,
+            help='Speed of replaying the capture relative to the original timing, 0 to replay as fast as possible'
+        )
+        self.parser.add_argument(
+            '--recv-batch-size',
+            default=64,
+            type=int,
+            help='Maximum number of datagrams received from a socket with a single system call'
+        )
+        self.parser.add_argument(
+            '--route-ttl',
+            default=3600,
+            type=float,
+            help='Number of seconds for which messages for a node are sent only to the gateway it was last heard from'
+        )
+        self.parser.add_argument(
+            '--route-max-size',
+            default=256,
+            type=int,
+            help='Maximum number of nodes for which the gateway they were last heard from is remembered'
+        )
+        self.parser.add_argument(
+            '--gateway-ttl',
+            default=3600,
+            type=float,
+            help='Number of seconds after which a gateway which did not send any message or discovery request '
+                 'is forgotten. Not applied with multiple workers, as only worker 0 keeps the gateways and '
+                 'messages of a gateway may be received by another worker'
+        )
+        self.parser.add_argument(
+            '--gateway-max-size',
+            default=1024,
+            type=int,
+            help='Maximum number of known gateways'
+        )
+        self.parser.add_argument(
+            '--rate-limit',
+            default=0,
+            type=float,
+            help='Number of messages per second accepted from a single gateway IP address, 0 to disable'
+        )
+        self.parser.add_argument(
+            '--rate-limit-burst',
+            default=200,
+            type=int,
+            help='Number of messages accepted from a single gateway address at once'
+        )
+        self.parser.add_argument(
+            '--discovery-rate-limit',
+            default=0,
+            type=float,
+            help='Number of dynamic discovery requests per second accepted from a single IP address, 0 to disable. '
+                 'The limit is per IP address only, so gateways behind the same NAT share it'
+        )
+        self.parser.add_argument(
+            '--discovery-rate-limit-burst',
+            default=5,
+            type=int,
+            help='Number of dynamic discovery requests accepted from a single IP address at once'
+        )
+        self.parser.add_argument(
+            '--rate-limit-max-sources',
+            default=4096,
+            type=int,
+            help='Maximum number of addresses tracked by rate limiting, the least recently seen one is forgotten first'
+        )
+        self.parser.add_argument(
+            '--no-sub-type-check',
+            default=True,
+            action='store_false',
+            dest='check_sub_type',
+            help='Accept messages with sub-types unknown to the supported protocol version'
+        )
+        self.parser.add_argument(
+            '--quarantine-size',
+            default=64,
+            type=int,
+            help='Number of the last rejected malformed messages kept for inspection on the metrics endpoint'
+        )
+        self.parser.add_argument(
+            '--zmq-format',
+            default='json',
+            choices=sorted(ENCODINGS),
+            help='Wire format of messages published over ZMQ'
+        )
+        self.parser.add_argument(
+            '--no-zmq-topic',
+            default=True,
+            action='store_false',
+            dest='zmq_topic',
+            help='Publish messages as a single frame without the topic frame used for filtering by subscribers'
+        )
+        self.parser.add_argument(
+            '--zmq-bind',
+            default=None,
+            action='append',
+            metavar='ENDPOINT',
+            help='ZMQ endpoint to which to bind the publisher socket, can be given multiple times, '
+                 'e.g. ipc:///run/sensor-net-proxy.ipc for local subscribers. '
+                 'Defaults to ' + ZmqProxy.DEFAULT_PUBLISH_ENDPOINT
+        )
+        self.parser.add_argument(
+            '--zmq-io-threads',
+            default=1,
+            type=int,
+            help='Number of ZMQ I/O threads'
+        )
+        self.parser.add_argument(
+            '--zmq-sndhwm',
+            default=None,
+            type=int,
+            help='Maximum number of messages queued for a single subscriber before dropping, ZMQ default if not set'
+        )
+        self.parser.add_argument(
+            '--zmq-sndbuf',
+            default=None,
+            type=int,
+            help='Size of the kernel send buffer of the publisher socket in bytes, OS default if not set'
+        )
+        self.parser.add_argument(
+            '--zmq-tcp-keepalive',
+            default=False,
+            action='store_true',
+            help='Send TCP keepalive probes to subscribers, so dead connections are detected'
+        )
+        self.parser.add_argument(
+            '--zmq-tcp-keepalive-idle',
+            default=None,
+            type=int,
+            help='Number of idle seconds before the first TCP keepalive probe, OS default if not set'
+        )
+        self.parser.add_argument(
+            '--zmq-tcp-keepalive-interval',
+            default=None,
+            type=int,
+            help='Number of seconds between TCP keepalive probes, OS default if not set'
+        )
+        self.parser.add_argument(
+            '--zmq-conflate',
+            default=False,
+            action='store_true',
+            help='Keep only the last message queued for a subscriber. Requires --no-zmq-topic'
+        )
+        self.parser.add_argument(
+            '--zmq-command-endpoint',
+            default=None,
+            help='ZMQ endpoint on which to receive messages for the gateways, e.g. tcp://controller:5557'
+        )
+        self.parser.add_argument(
+            '--zmq-command-socket',
+            default='sub',
+            choices=ZmqProxy.COMMAND_SOCKET_TYPES,
+            help='Type of the command socket. SUB connects to the endpoint, PULL binds to it'
+        )
+
+    @property
+    def listen_specs(self):
+        """
+        List of (interface, port) tuples on which to listen
+        """
+        if not self.args.listen:
+            return [(self.args.interface, int(self.args.port))]
+        return [(interface, int(self.args.port) if port is None else port) for interface, port in self.args.listen]
+
+    @property
+    def zmq_publish_endpoints(self):
+        """
+        List of endpoints to which to bind the publisher socket
+        """
+        return self.args.zmq_bind or [ZmqProxy.DEFAULT_PUBLISH_ENDPOINT]
 
     def __getattr__(self, name):
         try:
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Microbenchmarks of the MySensors message handling.
+
+Run as 'python3 -m sensor_net_proxy.bench'.
+"""
+
+import argparse
+import gc
+import statistics
+import time
+
+from sensor_net_proxy.encoding import ENCODINGS, msgpack
+from sensor_net_proxy.logger import logger, LoggerHelper, logging
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+
+class LegacyMySensorsMsg(object):
+    """
+    The original MySensorsMsg implementation, kept as the baseline for comparison.
+    """
+
+    def __init__(self, node_id, child_sensor_id, message_type, ack, sub_type, payload):
+        self.node_id = int(node_id)
+        self.child_sensor_id = int(child_sensor_id)
+        self.message_type = int(message_type)
+        self.ack = int(ack)
+        self.sub_type = int(sub_type)
+        self.payload = payload.decode()
+
+    def to_serial_msg(self):
+        return bytes('{node_id};{child_sensor_id};{message_type};{ack};{sub_type};{payload}\n'.format(**self.__dict__),
+                     'utf-8')
+
+    @staticmethod
+    def from_serial_msg(message):
+        logger.debug("Parsing MySensors message '{0}'".format(message.strip()))
+        return LegacyMySensorsMsg(*message.strip().split(b';'))
+
+
+def sample_messages(count):
+    """
+    Return list of realistic raw serial messages
+    """
+    templates = [b'%d;1;1;0;0;21.5\n',
+                 b'%d;2;1;0;1;45.2\n',
+                 b'%d;255;3;0;0;97\n',
+                 b'%d;3;1;0;16;1\n']
+    return [templates[i % len(templates)] % (i % 254 + 1) for i in range(count)]
+
+
+def measure(func, count, repeat=5, setup=None):
+    """
+    Run the function 'repeat' times and return the best and the median throughput
+    in operations per second. The garbage collector is disabled during the timed
+    runs, as in timeit, so collections do not make the results noisy.
+
+    :param func: callable doing 'count' operations
+    :param count: number of operations done by a single func call
+    :param repeat: number of repetitions
+    :param setup: callable run before each repetition, which is not measured. If given,
+                  its return value is passed to func.
+    :return: (best, median) operations per second
+    """
+    timings = []
+    for _ in range(repeat):
+        data = setup() if setup is not None else None
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if setup is None:
+                start = time.perf_counter()
+                func()
+            else:
+                start = time.perf_counter()
+                func(data)
+            timings.append(time.perf_counter() - start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    return count / min(timings), count / statistics.median(timings)
+
+
+def bench_parse(messages):
+    """
+    Return list of (name, (best, median) messages per second) tuples for the parsing benchmarks
+    """
+    count = len(messages)
+    results = [
+        ('legacy from_serial_msg', measure(lambda: [LegacyMySensorsMsg.from_serial_msg(m) for m in messages], count)),
+        ('from_serial_msg', measure(lambda: [MySensorsMsg.from_serial_msg(m) for m in messages], count)),
+        ('parse_many', measure(lambda: MySensorsMsg.parse_many(messages), count)),
+        ('parse_valid', measure(lambda: [MySensorsMsg.parse_valid(m) for m in messages], count)),
+        ('parse_many + payload', measure(lambda: [m.payload for m in MySensorsMsg.parse_many(messages)], count)),
+    ]
+    return results
+
+
+def bench_serialize(messages):
+    """
+    Return list of (name, (best, median) messages per second) tuples for the serialization benchmarks
+    """
+    count = len(messages)
+    legacy_msgs = [LegacyMySensorsMsg.from_serial_msg(m) for m in messages]
+    cached_msgs = MySensorsMsg.parse_many(messages)
+    for m in cached_msgs:
+        m.to_serial_msg()
+
+    def fresh_msgs():
+        # messages created from fields, so the serial form is not cached yet
+        return [MySensorsMsg(m.node_id, m.child_sensor_id, m.message_type, m.ack, m.sub_type, m.payload)
+                for m in legacy_msgs]
+
+    return [
+        ('legacy to_serial_msg', measure(lambda: [m.to_serial_msg() for m in legacy_msgs], count)),
+        ('to_serial_msg', measure(lambda msgs: [m.to_serial_msg() for m in msgs], count, setup=fresh_msgs)),
+        ('to_serial_msg cached', measure(lambda: [m.to_serial_msg() for m in cached_msgs], count)),
+    ]
+
+
+def bench_encode(messages):
+    """
+    Return list of (name, (best, median) messages per second) tuples for the ZMQ wire format benchmarks
+    """
+    msgs = MySensorsMsg.parse_many(messages)
+    for m in msgs:
+        m.payload  # decode the payload in advance, so only the encoding is measured
+
+    results = []
+    for name, encoding in sorted(ENCODINGS.items()):
+        if name == 'msgpack' and msgpack is None:
+            continue
+        results.append(('encode ' + name, measure(lambda: [encoding.encode(m) for m in msgs], len(msgs))))
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='MySensors message microbenchmarks',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--messages', type=int, default=100000, help='Number of messages per run')
+    conf = parser.parse_args(args)
+
+    # the proxy runs with INFO level console logging
+    LoggerHelper.add_stream_handler(logger, logging.INFO)
+    messages = sample_messages(conf.messages)
+
+    print('{0:<30} {1:>12} {2:>12}'.format('', 'best msg/s', 'median msg/s'))
+    for name, (best, median) in bench_parse(messages) + bench_serialize(messages) + bench_encode(messages):
+        print('{0:<30} {1:>12,.0f} {2:>12,.0f}'.format(name, best, median))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import collections
+import time
+
+
+_MISSING = object()
+
+
+class ExpiringCache(object):
+    """
+    Bounded mapping with entries expiring after given time since their last update.
+
+    Entries are kept ordered by the time of the last update, so both expiration and
+    eviction of the least recently updated entry are O(1) per entry.
+    """
+
+    def __init__(self, ttl=None, max_size=None, clock=time.monotonic, on_evict=None):
+        """
+        :param ttl: number of seconds after which an entry expires, None for no expiration
+        :param max_size: maximum number of entries, None for no limit
+        :param clock: function returning the current time in seconds
+        :param on_evict: function called with key and value of an entry evicted because the cache is full
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._on_evict = on_evict
+        self._entries = collections.OrderedDict()
+        # statistics
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _is_expired(self, timestamp, now):
+        return self.ttl is not None and now - timestamp > self.ttl
+
+    def get(self, key, default=None):
+        """
+        Return value stored for the key or default if there is no such key or the entry expired.
+        """
+        try:
+            timestamp, value = self._entries[key]
+        except KeyError:
+            return default
+        if self._is_expired(timestamp, self._clock()):
+            del self._entries[key]
+            self.expired += 1
+            return default
+        return value
+
+    def get_timestamp(self, key):
+        """
+        Return the time of the last update of the key or None if there is no such key.
+        """
+        try:
+            return self._entries[key][0]
+        except KeyError:
+            return None
+
+    def set(self, key, value):
+        """
+        Store the value for the key, refresh its timestamp and evict the least recently
+        updated entry if the cache is full.
+
+        :return: True if the key was not in the cache before, otherwise False
+        """
+        entries = self._entries
+        new = key not in entries
+        entries[key] = (self._clock(), value)
+        if not new:
+            entries.move_to_end(key)
+        elif self.max_size is not None and len(entries) > self.max_size:
+            evicted_key, (_, evicted_value) = entries.popitem(last=False)
+            self.evicted += 1
+            if self._on_evict is not None:
+                self._on_evict(evicted_key, evicted_value)
+        return new
+
+    def pop(self, key, default=None):
+        """
+        Remove the key and return its value or default if there is no such key.
+        """
+        try:
+            return self._entries.pop(key)[1]
+        except KeyError:
+            return default
+
+    def expire(self):
+        """
+        Remove all expired entries
+
+        :return: list of (key, value) tuples of removed entries
+        """
+        if self.ttl is None:
+            return []
+        now = self._clock()
+        removed = []
+        entries = self._entries
+        while entries:
+            key, (timestamp, value) = next(iter(entries.items()))
+            if not self._is_expired(timestamp, now):
+                break
+            del entries[key]
+            removed.append((key, value))
+        self.expired += len(removed)
+        return removed
+
+    def items(self):
+        """
+        Return list of (key, value) tuples of entries which did not expire yet
+        """
+        now = self._clock()
+        return [(key, value) for key, (timestamp, value) in self._entries.items()
+                if not self._is_expired(timestamp, now)]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def clear(self):
+        self._entries.clear()
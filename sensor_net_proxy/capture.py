@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Capture files of datagrams received from gateways.
+
+The file starts with the MAGIC bytes followed by records. Each record consists of the wall clock
+time of receiving as a double, IPv4 address and port of the gateway and the length of the datagram,
+all in the network byte order, followed by the datagram.
+"""
+
+import socket
+import struct
+import time
+
+from sensor_net_proxy.exceptions import SensorNetProxyError
+
+MAGIC = b'SNPCAP01'
+
+_RECORD = struct.Struct('!d4sHH')
+# size of the write buffer of the capture file
+_BUFFER_SIZE = 1024 * 1024
+
+
+class CaptureWriter(object):
+    """
+    Writes received datagrams into a capture file
+    """
+
+    def __init__(self, path):
+        try:
+            self._file = open(path, 'wb', buffering=_BUFFER_SIZE)
+            self._file.write(MAGIC)
+        except (IOError, OSError) as e:
+            raise SensorNetProxyError("Can not create capture file '{0}': {1}".format(path, e))
+        self._pack = _RECORD.pack
+        # number of written datagrams
+        self.written = 0
+
+    def write(self, datagrams, timestamp=None):
+        """
+        Write a batch of datagrams received at the same time
+
+        :param datagrams: list of (bytes, (address, port)) tuples
+        :param timestamp: time.time() time of receiving, now if None
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        write = self._file.write
+        pack = self._pack
+        for data, (address, port) in datagrams:
+            write(pack(timestamp, socket.inet_aton(address), port, len(data)))
+            write(data)
+        self.written += len(datagrams)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CaptureReader(object):
+    """
+    Reads batches of datagrams from a capture file
+    """
+
+    def __init__(self, path):
+        try:
+            self._file = open(path, 'rb', buffering=_BUFFER_SIZE)
+            magic = self._file.read(len(MAGIC))
+        except (IOError, OSError) as e:
+            raise SensorNetProxyError("Can not open capture file '{0}': {1}".format(path, e))
+        if magic != MAGIC:
+            self._file.close()
+            raise SensorNetProxyError("File '{0}' is not a capture file".format(path))
+        self._next = None
+
+    def peek_time(self):
+        """
+        Return time of receiving of the next datagram or None at the end of the file
+        """
+        if self._next is None:
+            self._next = self._read_record()
+        return None if self._next is None else self._next[0]
+
+    def read_batch(self, max_count, until=None):
+        """
+        Read up to max_count datagrams
+
+        :param max_count: maximum number of returned datagrams
+        :param until: return only datagrams received at this time or before, all if None
+        :return: list of (bytes, (address, port)) tuples, empty at the end of the file
+        """
+        batch = []
+        while len(batch) < max_count:
+            timestamp = self.peek_time()
+            if timestamp is None or (until is not None and timestamp > until):
+                break
+            batch.append(self._next[1])
+            self._next = None
+        return batch
+
+    def _read_record(self):
+        header = self._file.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return None
+        timestamp, address, port, length = _RECORD.unpack(header)
+        data = self._file.read(length)
+        if len(data) < length:
+            return None
+        return timestamp, (data, (socket.inet_ntoa(address), port))
+
+    def close(self):
+        self._file.close()
+
+
+class CaptureReplayer(object):
+    """
+    Replays datagrams from a capture file with the original timing, scaled by the speed,
+    or as fast as possible.
+    """
+
+    def __init__(self, path, speed=1.0, batch_size=64, clock=time.monotonic):
+        """
+        :param path: path to the capture file
+        :param speed: replay speed relative to the original timing, 0 to replay as fast as possible
+        :param batch_size: maximum number of datagrams returned at once
+        :param clock: function returning the current time in seconds
+        """
+        self._reader = CaptureReader(path)
+        self._speed = speed
+        self._batch_size = batch_size
+        self._clock = clock
+        self._start = None
+        self._capture_start = None
+        # number of replayed datagrams
+        self.replayed = 0
+
+    def next_batch(self):
+        """
+        Return the datagrams which are due to be replayed
+
+        :return: list of (bytes, (address, port)) tuples, possibly empty, or None at the end of the capture
+        """
+        if self._capture_start is None:
+            self._capture_start = self._reader.peek_time()
+            self._start = self._clock()
+            if self._capture_start is None:
+                return None
+
+        if self._speed > 0:
+            until = self._capture_start + (self._clock() - self._start) * self._speed
+        else:
+            until = None
+        batch = self._reader.read_batch(self._batch_size, until)
+        if not batch and self._reader.peek_time() is None:
+            return None
+        self.replayed += len(batch)
+        return batch
+
+    @property
+    def elapsed(self):
+        return 0.0 if self._start is None else self._clock() - self._start
+
+    def close(self):
+        self._reader.close()
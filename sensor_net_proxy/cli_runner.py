@@ -23,6 +23,7 @@ from sensor_net_proxy.logger import logger
 from sensor_net_proxy.exceptions import SensorNetProxyError
 from sensor_net_proxy.args_parser import ArgsParser
 from sensor_net_proxy.application import Application
+from sensor_net_proxy.workers import WorkerPool
 
 
 class CliRunner(object):
@@ -31,8 +32,11 @@ class CliRunner(object):
     def run():
         try:
             args = ArgsParser(sys.argv[1:])
-            app = Application(args)
-            app.run()
+            if args.workers > 1:
+                WorkerPool(args, args.workers).run()
+            else:
+                app = Application(args)
+                app.run()
         except KeyboardInterrupt:
             logger.info('\nInterrupted by user')
         except SensorNetProxyError as e:
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import collections
+import time
+
+from sensor_net_proxy.cache import ExpiringCache
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+
+class Coalescer(object):
+    """
+    Suppresses repeated SET messages with unchanged payload.
+
+    Messages are keyed on (node_id, child_sensor_id, message_type, sub_type). The first message
+    for a key is forwarded and opens a window. Within the window, messages with the same payload
+    as the last forwarded one are suppressed. Messages with changed payload are either forwarded
+    immediately, opening a new window, or the last of them is forwarded when the window closes.
+    Other than SET messages are always forwarded.
+    """
+
+    IMMEDIATE = 'immediate'
+    LAST_VALUE = 'last-value'
+    MODES = (IMMEDIATE, LAST_VALUE)
+
+    def __init__(self, window, mode=IMMEDIATE, max_entries=4096, clock=time.monotonic):
+        """
+        :param window: length of the window in seconds
+        :param mode: IMMEDIATE to forward changed payloads immediately, LAST_VALUE to forward
+                     only the last changed payload when the window closes
+        :param max_entries: maximum number of tracked keys, the least recently updated key is forgotten first
+        :param clock: function returning the current time in seconds
+        """
+        if mode not in Coalescer.MODES:
+            raise SensorNetProxyError("Unknown coalescing mode '{0}'. Known modes are '{1}'".format(
+                mode, str(Coalescer.MODES)))
+        self.window = window
+        self.mode = mode
+        self._clock = clock
+        # key -> [window end, last forwarded payload, message waiting for the window end]
+        self._entries = ExpiringCache(max_size=max_entries, clock=clock, on_evict=self._on_evict)
+        # (window end, key) in the order the windows were opened
+        self._deadlines = collections.deque()
+        # waiting messages of forgotten keys
+        self._evicted = []
+        # number of suppressed messages
+        self.suppressed = 0
+
+    def _on_evict(self, key, entry):
+        if entry[2] is not None:
+            self._evicted.append(entry[2])
+
+    def _open_window(self, key, msg, now):
+        window_end = now + self.window
+        self._entries.set(key, [window_end, msg.payload, None])
+        if self.mode == Coalescer.LAST_VALUE:
+            self._deadlines.append((window_end, key))
+
+    def process(self, msgs):
+        """
+        Return messages which should be forwarded now
+
+        :param msgs: list of MySensorsMsg
+        :return: list of MySensorsMsg
+        """
+        now = self._clock()
+        forward = []
+        for msg in msgs:
+            if msg.message_type != MySensorsMsg.MSG_TYPE_SET:
+                forward.append(msg)
+                continue
+
+            key = (msg.node_id, msg.child_sensor_id, msg.message_type, msg.sub_type)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self._open_window(key, msg, now)
+                forward.append(msg)
+            elif msg.payload == entry[1]:
+                # the value is the same as the forwarded one, drop also any waiting change
+                if entry[2] is not None:
+                    self.suppressed += 1
+                    entry[2] = None
+                self.suppressed += 1
+            elif self.mode == Coalescer.IMMEDIATE:
+                self._open_window(key, msg, now)
+                forward.append(msg)
+            else:
+                if entry[2] is not None:
+                    self.suppressed += 1
+                entry[2] = msg
+
+        if self._evicted:
+            forward.extend(self._evicted)
+            self._evicted = []
+        return forward
+
+    def flush(self):
+        """
+        Return messages waiting for their window to close, whose window already closed
+
+        :return: list of MySensorsMsg
+        """
+        now = self._clock()
+        forward = []
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            window_end, key = deadlines.popleft()
+            entry = self._entries.get(key)
+            # skip windows of forgotten keys and windows which were already replaced
+            if entry is None or entry[0] != window_end or entry[2] is None:
+                continue
+            msg = entry[2]
+            self._open_window(key, msg, now)
+            forward.append(msg)
+
+        if self._evicted:
+            forward.extend(self._evicted)
+            self._evicted = []
+        return forward
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import sys
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_ushort),
+                ('sin_addr', ctypes.c_ubyte * 4),
+                ('sin_zero', ctypes.c_ubyte * 8)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+def _load_libc_function(name, argtypes):
+    """
+    Return the libc function with given name or None if it is not available.
+
+    :param argtypes: list of ctypes types of the function arguments
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = argtypes
+    func.restype = ctypes.c_int
+    return func
+
+
+# int recvmmsg(int sockfd, struct mmsghdr *msgvec, unsigned int vlen, int flags, struct timespec *timeout)
+_recvmmsg = _load_libc_function('recvmmsg', [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int,
+                                             ctypes.c_void_p])
+# int sendmmsg(int sockfd, struct mmsghdr *msgvec, unsigned int vlen, int flags)
+_sendmmsg = _load_libc_function('sendmmsg', [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int])
+
+MSG_TRUNC = getattr(socket, 'MSG_TRUNC', 0)
+
+
+class DatagramReceiver(object):
+    """
+    Receiver of datagrams in batches into a preallocated ring of small buffers.
+
+    recvmmsg() is used where available, otherwise recvfrom_into() is called in a loop.
+    """
+
+    def __init__(self, batch_size=64, buffer_size=256, use_recvmmsg=True):
+        """
+        :param batch_size: maximum number of datagrams received in one batch
+        :param buffer_size: size of each buffer, longer datagrams are dropped and listed in oversized
+        :param use_recvmmsg: whether to use recvmmsg() if it is available
+        """
+        self.batch_size = int(batch_size)
+        self.buffer_size = int(buffer_size)
+        self._use_recvmmsg = use_recvmmsg and _recvmmsg is not None
+        # (truncated data, client) tuples of datagrams dropped from the last batch for being too long
+        self.oversized = []
+
+        if self._use_recvmmsg:
+            self._init_recvmmsg()
+        else:
+            self._buffers = [bytearray(self.buffer_size) for _ in range(self.batch_size)]
+            self._views = [memoryview(b) for b in self._buffers]
+
+    def _init_recvmmsg(self):
+        self._buffers = (ctypes.c_char * self.buffer_size * self.batch_size)()
+        self._iovecs = (_IoVec * self.batch_size)()
+        self._addrs = (_SockAddrIn * self.batch_size)()
+        self._msgs = (_MMsgHdr * self.batch_size)()
+
+        for i in range(self.batch_size):
+            self._iovecs[i].iov_base = ctypes.addressof(self._buffers[i])
+            self._iovecs[i].iov_len = self.buffer_size
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._addrs[i])
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            hdr.msg_iovlen = 1
+
+    @property
+    def uses_recvmmsg(self):
+        return self._use_recvmmsg
+
+    def recv_batch(self, sock):
+        """
+        Receive up to batch_size datagrams queued on the socket without blocking.
+
+        :param sock: datagram socket
+        :return: list of (data, client) tuples, empty if there is nothing queued
+        """
+        if self.oversized:
+            self.oversized = []
+        if self._use_recvmmsg:
+            return self._recv_batch_recvmmsg(sock)
+        return self._recv_batch_fallback(sock)
+
+    def _recv_batch_recvmmsg(self, sock):
+        for i in range(self.batch_size):
+            self._msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+
+        count = _recvmmsg(sock.fileno(), self._msgs, self.batch_size, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, 'recvmmsg: {0}'.format(errno.errorcode.get(err, err)))
+
+        datagrams = []
+        for i in range(count):
+            hdr = self._msgs[i].msg_hdr
+            addr = self._addrs[i]
+            client = (socket.inet_ntoa(bytes(addr.sin_addr)), socket.ntohs(addr.sin_port))
+            data = ctypes.string_at(self._iovecs[i].iov_base, min(self._msgs[i].msg_len, self.buffer_size))
+            if hdr.msg_flags & MSG_TRUNC:
+                self.oversized.append((data, client))
+                continue
+            datagrams.append((data, client))
+        return datagrams
+
+    def _recv_batch_fallback(self, sock):
+        datagrams = []
+        for view in self._views:
+            try:
+                length, client = sock.recvfrom_into(view, 0, socket.MSG_DONTWAIT | MSG_TRUNC)
+            except BlockingIOError:
+                break
+            if length > self.buffer_size:
+                self.oversized.append((bytes(view), client))
+                continue
+            datagrams.append((bytes(view[:length]), client))
+        return datagrams
+
+
+class DatagramSender(object):
+    """
+    Sender of one datagram to many destinations using a single sendmmsg() call where available.
+    """
+
+    def __init__(self, use_sendmmsg=True):
+        """
+        :param use_sendmmsg: whether to use sendmmsg() if it is available
+        """
+        self._use_sendmmsg = use_sendmmsg and _sendmmsg is not None
+        self._capacity = 0
+        self._iovec = _IoVec()
+
+    @property
+    def uses_sendmmsg(self):
+        return self._use_sendmmsg
+
+    def _ensure_capacity(self, count):
+        if count <= self._capacity:
+            return
+        self._capacity = max(count, 2 * self._capacity)
+        self._addrs = (_SockAddrIn * self._capacity)()
+        self._msgs = (_MMsgHdr * self._capacity)()
+        for i in range(self._capacity):
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._addrs[i])
+            hdr.msg_namelen = ctypes.sizeof(_SockAddrIn)
+            hdr.msg_iov = ctypes.pointer(self._iovec)
+            hdr.msg_iovlen = 1
+
+    def send_batch(self, sock, data, addresses):
+        """
+        Send the same data to all addresses.
+
+        :param sock: datagram socket
+        :param data: bytes to send
+        :param addresses: list of (IPv4 address, port) tuples
+        :return: None
+        """
+        if not self._use_sendmmsg or len(addresses) < 2:
+            for addr in addresses:
+                sock.sendto(data, addr)
+            return
+
+        self._ensure_capacity(len(addresses))
+        for i, (host, port) in enumerate(addresses):
+            addr = self._addrs[i]
+            addr.sin_family = socket.AF_INET
+            addr.sin_port = socket.htons(port)
+            addr.sin_addr[:] = socket.inet_aton(host)
+        # the iovec points directly to the bytes object, which is referenced until the function returns
+        self._iovec.iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+        self._iovec.iov_len = len(data)
+
+        sent = 0
+        while sent < len(addresses):
+            msgs = ctypes.cast(ctypes.addressof(self._msgs) + sent * ctypes.sizeof(_MMsgHdr),
+                               ctypes.POINTER(_MMsgHdr))
+            count = _sendmmsg(sock.fileno(), msgs, len(addresses) - sent, 0)
+            if count < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, 'sendmmsg: {0}'.format(errno.errorcode.get(err, err)))
+            sent += count
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Wire formats of messages published over ZMQ.
+
+Subscribers can decode the published frames using decode(), which returns a dictionary
+with the same keys for all formats:
+'node_id', 'child_sensor_id', 'message_type', 'ack', 'sub_type' and 'payload'.
+
+Messages are published as two frames, the topic and the encoded message. The topic is four
+bytes with node_id, child_sensor_id, message_type and sub_type, so subscribers can filter
+messages in ZMQ by subscribing to topic_prefix(node_id, ...).
+
+When the proxy spools published messages, the topic frame is followed by a frame with the offset
+of the message in the spool, so a subscriber can resume from the replay endpoint after a disconnect.
+The offset frame is empty if the message could not be spooled. Replayed messages use the same layout.
+"""
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from sensor_net_proxy.exceptions import SensorNetProxyError
+
+
+FIELDS = ('node_id', 'child_sensor_id', 'message_type', 'ack', 'sub_type', 'payload')
+TOPIC_FIELDS = ('node_id', 'child_sensor_id', 'message_type', 'sub_type')
+
+_topic = struct.Struct('!BBBB')
+_offset = struct.Struct('!Q')
+
+
+def make_topic(msg):
+    """
+    Return the topic frame of the message
+
+    :param msg: MySensorsMsg
+    :return: bytes
+    """
+    return _topic.pack(msg.node_id, msg.child_sensor_id, msg.message_type, msg.sub_type)
+
+
+def topic_prefix(node_id=None, child_sensor_id=None, message_type=None, sub_type=None):
+    """
+    Return topic prefix for subscribing to a subset of messages. The fields are used in order
+    until the first one which is None, e.g. topic_prefix(12, 1) matches all messages from
+    child sensor 1 on node 12. No arguments match all messages.
+
+    :return: bytes to be used with zmq.SUBSCRIBE
+    """
+    prefix = bytearray()
+    for value in (node_id, child_sensor_id, message_type, sub_type):
+        if value is None:
+            break
+        prefix.append(value)
+    return bytes(prefix)
+
+
+def make_offset(offset):
+    """
+    Return the offset frame of a spooled message
+
+    :param offset: offset of the message in the spool or None if it was not spooled
+    :return: bytes
+    """
+    return b'' if offset is None else _offset.pack(offset)
+
+
+def parse_offset(frame):
+    """
+    Return offset of the message in the spool from the offset frame or None if it was not spooled
+    """
+    return _offset.unpack(frame)[0] if frame else None
+
+
+def parse_topic(topic):
+    """
+    Return dictionary with node_id, child_sensor_id, message_type and sub_type from the topic frame
+    """
+    return dict(zip(TOPIC_FIELDS, _topic.unpack(topic)))
+
+
+class JsonEncoding(object):
+    """
+    JSON object with string keys, the default and backward compatible format
+    """
+
+    name = 'json'
+
+    @staticmethod
+    def encode(msg):
+        return json.dumps(msg.to_dict()).encode('utf-8')
+
+    @staticmethod
+    def decode(data):
+        return json.loads(data.decode('utf-8'))
+
+
+class StructEncoding(object):
+    """
+    Fixed layout binary frame. Five unsigned bytes with node_id, child_sensor_id, message_type,
+    ack and sub_type followed by the UTF-8 encoded payload till the end of the frame.
+    """
+
+    name = 'struct'
+    header = struct.Struct('!BBBBB')
+
+    @staticmethod
+    def encode(msg):
+        return StructEncoding.header.pack(msg.node_id, msg.child_sensor_id, msg.message_type, msg.ack,
+                                          msg.sub_type) + msg.payload.encode('utf-8')
+
+    @staticmethod
+    def decode(data):
+        header_size = StructEncoding.header.size
+        try:
+            values = StructEncoding.header.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(str(e))
+        return dict(zip(FIELDS, values + (bytes(data[header_size:]).decode('utf-8'),)))
+
+
+class MsgpackEncoding(object):
+    """
+    MessagePack array with fields in the order of FIELDS. Requires the msgpack module.
+    """
+
+    name = 'msgpack'
+
+    @staticmethod
+    def encode(msg):
+        return msgpack.packb((msg.node_id, msg.child_sensor_id, msg.message_type, msg.ack, msg.sub_type,
+                              msg.payload))
+
+    @staticmethod
+    def decode(data):
+        return dict(zip(FIELDS, msgpack.unpackb(data)))
+
+
+ENCODINGS = {
+    JsonEncoding.name: JsonEncoding,
+    StructEncoding.name: StructEncoding,
+    MsgpackEncoding.name: MsgpackEncoding,
+}
+
+
+def get_encoding(name):
+    """
+    Return the encoding class with given name
+
+    :param name: name of the encoding
+    :return: encoding class
+    """
+    try:
+        encoding = ENCODINGS[name]
+    except KeyError:
+        raise SensorNetProxyError("Unknown encoding '{0}'. Known encodings are '{1}'".format(
+            name, str(sorted(ENCODINGS))))
+
+    if encoding is MsgpackEncoding and msgpack is None:
+        raise SensorNetProxyError("The '{0}' encoding requires the msgpack module".format(name))
+
+    return encoding
+
+
+def decode(name, data):
+    """
+    Decode message published in the given format
+
+    :param name: name of the encoding
+    :param data: bytes of the published frame
+    :return: dictionary with message fields
+    """
+    return get_encoding(name).decode(data)
+
+
+def decode_multipart(name, frames):
+    """
+    Decode message received as a list of frames, with or without the topic frame
+
+    :param name: name of the encoding
+    :param frames: list of received frames
+    :return: dictionary with message fields
+    """
+    return decode(name, frames[-1])
+
+
+def decode_snapshot(name, frames):
+    """
+    Decode reply of the snapshot endpoint
+
+    :param name: name of the encoding
+    :param frames: list of received frames
+    :return: list of dictionaries with message fields
+    """
+    return [decode(name, data) for data in frames[2::2]]
+
+
+def decode_replay(name, frames):
+    """
+    Decode reply of the replay endpoint
+
+    :param name: name of the encoding
+    :param frames: list of received frames
+    :return: tuple of the first retained offset, the offset following the last message in the spool
+             and list of (offset, dictionary with message fields) tuples
+    """
+    records = [(parse_offset(frames[i + 1]), decode(name, frames[i + 2])) for i in range(2, len(frames) - 2, 3)]
+    return int(frames[0]), int(frames[1]), records
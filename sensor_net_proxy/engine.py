@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import asyncio
+import select
+import time
+
+from sensor_net_proxy.logger import logger
+
+
+class SelectEngine(object):
+    """
+    The legacy engine polling all registered sockets using select().
+    """
+
+    name = 'select'
+
+    def __init__(self):
+        self._readers = {}
+        self._timers = []
+        self._running = False
+
+    def add_reader(self, sock, callback):
+        """
+        Register callback which is called when the socket becomes readable.
+
+        :param sock: socket object or file descriptor
+        :param callback: callable taking the socket as the only argument
+        :return: None
+        """
+        self._readers[sock] = callback
+
+    def remove_reader(self, sock):
+        """
+        Unregister the socket from the engine.
+        """
+        self._readers.pop(sock, None)
+
+    def call_periodically(self, interval, callback):
+        """
+        Call the callback every 'interval' seconds.
+
+        :param interval: number of seconds between calls
+        :param callback: callable without arguments
+        :return: None
+        """
+        self._timers.append([time.monotonic() + interval, interval, callback])
+
+    def _get_timeout(self):
+        if not self._timers:
+            return None
+        return max(0, min(timer[0] for timer in self._timers) - time.monotonic())
+
+    def _run_timers(self):
+        now = time.monotonic()
+        for timer in self._timers:
+            if timer[0] <= now:
+                timer[0] = now + timer[1]
+                timer[2]()
+
+    def run(self):
+        """
+        Run the loop until stop() is called or an exception is raised by some callback.
+        """
+        self._running = True
+        while self._running:
+            ready_r, _, _ = select.select(list(self._readers), [], [], self._get_timeout())
+            for s in ready_r:
+                # a callback may have removed the socket
+                callback = self._readers.get(s)
+                if callback is not None:
+                    callback(s)
+            self._run_timers()
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        pass
+
+
+class AsyncioEngine(object):
+    """
+    Engine based on the asyncio event loop (epoll on Linux).
+
+    The callbacks are expected to drain all data queued on the socket, since the
+    event loop does not rescan all sockets on every wakeup.
+    """
+
+    name = 'asyncio'
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_exception_handler(self._handle_exception)
+        self._exception = None
+
+    def add_reader(self, sock, callback):
+        """
+        Register callback which is called when the socket becomes readable.
+
+        :param sock: socket object or file descriptor
+        :param callback: callable taking the socket as the only argument
+        :return: None
+        """
+        self._loop.add_reader(sock, callback, sock)
+
+    def remove_reader(self, sock):
+        """
+        Unregister the socket from the engine.
+        """
+        self._loop.remove_reader(sock)
+
+    def call_periodically(self, interval, callback):
+        """
+        Call the callback every 'interval' seconds.
+
+        :param interval: number of seconds between calls
+        :param callback: callable without arguments
+        :return: None
+        """
+        def _call():
+            self._loop.call_later(interval, _call)
+            callback()
+
+        self._loop.call_later(interval, _call)
+
+    def run(self):
+        """
+        Run the loop until stop() is called or an exception is raised by some callback.
+        """
+        self._loop.run_forever()
+        if self._exception is not None:
+            exception, self._exception = self._exception, None
+            raise exception
+
+    def stop(self):
+        self._loop.stop()
+
+    def close(self):
+        self._loop.close()
+
+    def _handle_exception(self, loop, context):
+        """
+        Stop the loop on unhandled exception, so it is propagated from run() as with the select engine.
+        """
+        exception = context.get('exception')
+        if exception is None:
+            logger.error(context.get('message'))
+            return
+        self._exception = exception
+        loop.stop()
+
+
+ENGINES = {
+    SelectEngine.name: SelectEngine,
+    AsyncioEngine.name: AsyncioEngine,
+}
@@ -24,3 +24,11 @@ class SensorNetProxyError(Exception):
     catching some expected and well known exception/error.
     """
     pass
+
+
+class MalformedMsgError(ValueError):
+    """
+    Class representing Error raised when a received message can not be parsed
+    or its fields are out of range.
+    """
+    pass
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from sensor_net_proxy.cache import ExpiringCache
+
+
+class GatewayRegistry(object):
+    """
+    Registry of known Ethernet gateways keyed by the gateway address.
+    """
+
+    def __init__(self, ttl=None, max_size=None):
+        """
+        :param ttl: number of seconds after which a gateway which was not seen is forgotten, None to never forget
+        :param max_size: maximum number of gateways, the least recently seen gateway is forgotten first
+        """
+        self._gateways = ExpiringCache(ttl, max_size)
+        # statistics
+        self.added = 0
+        self.refreshed = 0
+
+    def __len__(self):
+        return len(self._gateways)
+
+    def __contains__(self, gw_addr):
+        return gw_addr in self._gateways
+
+    def update(self, gw_addr, proxy_socket):
+        """
+        Add the gateway or refresh its last seen time
+
+        :param gw_addr: (address, port) tuple of the gateway
+        :param proxy_socket: socket used for sending messages to the gateway
+        :return: True if the gateway was not known before
+        """
+        new = self._gateways.set(gw_addr, proxy_socket)
+        if new:
+            self.added += 1
+        else:
+            self.refreshed += 1
+        return new
+
+    def refresh(self, gw_addr):
+        """
+        Refresh last seen time of the gateway if it is known.
+
+        :return: True if the gateway is known
+        """
+        proxy_socket = self._gateways.get(gw_addr)
+        if proxy_socket is None:
+            return False
+        self._gateways.set(gw_addr, proxy_socket)
+        self.refreshed += 1
+        return True
+
+    def get(self, gw_addr):
+        """
+        Return socket used for sending messages to the gateway or None if the gateway is not known.
+        """
+        return self._gateways.get(gw_addr)
+
+    def remove(self, gw_addr):
+        return self._gateways.pop(gw_addr)
+
+    def expire(self):
+        """
+        Forget gateways which were not seen for too long
+
+        :return: list of (gateway address, proxy socket) tuples of forgotten gateways
+        """
+        return self._gateways.expire()
+
+    def gateways(self):
+        """
+        Return list of (gateway address, proxy socket) tuples of all known gateways
+        """
+        return self._gateways.items()
+
+    def stats(self):
+        """
+        Return dictionary with size and churn statistics of the registry
+        """
+        return {'size': len(self._gateways),
+                'added': self.added,
+                'refreshed': self.refreshed,
+                'expired': self._gateways.expired,
+                'evicted': self._gateways.evicted}
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import zmq
+
+from sensor_net_proxy.cache import ExpiringCache
+from sensor_net_proxy.encoding import make_topic
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+
+class LastValueCache(object):
+    """
+    Cache of the latest message per (node_id, child_sensor_id, message_type, sub_type).
+
+    Only messages describing the state of nodes are cached, that is presentations, SET messages
+    and internal messages with battery level and sketch name and version. Messages are kept
+    as their serial representation.
+    """
+
+    CACHED_INTERNAL_TYPES = frozenset([MySensorsMsg.INTERNAL_TYPE_BATTERY_LEVEL,
+                                       MySensorsMsg.INTERNAL_TYPE_SKETCH_NAME,
+                                       MySensorsMsg.INTERNAL_TYPE_SKETCH_VERSION])
+
+    def __init__(self, max_entries=None):
+        """
+        :param max_entries: maximum number of cached messages, the least recently updated one is dropped first
+        """
+        self._entries = ExpiringCache(max_size=max_entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def is_cached_type(msg):
+        if msg.message_type in (MySensorsMsg.MSG_TYPE_SET, MySensorsMsg.MSG_TYPE_PRESENTATION):
+            return True
+        return (msg.message_type == MySensorsMsg.MSG_TYPE_INTERNAL and
+                msg.sub_type in LastValueCache.CACHED_INTERNAL_TYPES)
+
+    def update(self, msgs):
+        """
+        Store messages describing the state of nodes
+
+        :param msgs: list of MySensorsMsg
+        """
+        for msg in msgs:
+            if LastValueCache.is_cached_type(msg):
+                self._entries.set((msg.node_id, msg.child_sensor_id, msg.message_type, msg.sub_type),
+                                  msg.to_serial_msg())
+
+    def snapshot(self, prefix=b''):
+        """
+        Return cached messages whose topic starts with the prefix
+
+        :param prefix: topic prefix as returned by encoding.topic_prefix(), empty for all messages
+        :return: list of MySensorsMsg
+        """
+        msgs = MySensorsMsg.parse_many(self._entries.values())
+        if prefix:
+            msgs = [msg for msg in msgs if make_topic(msg).startswith(prefix)]
+        return msgs
+
+
+class SnapshotServer(object):
+    """
+    REP socket serving snapshots of the last value cache to late joining subscribers.
+
+    The request is a single frame with a topic prefix, empty to request all messages. The reply
+    starts with a frame with the number of messages followed by a topic frame and a message frame
+    for each message in the snapshot, see encoding.decode_snapshot().
+    """
+
+    def __init__(self, zmq_ctx, endpoint, cache, encoding):
+        """
+        :param zmq_ctx: ZMQ context
+        :param endpoint: endpoint to bind the socket to
+        :param cache: LastValueCache
+        :param encoding: encoding class of the replied messages
+        """
+        self._cache = cache
+        self._encoding = encoding
+        self._socket = zmq_ctx.socket(zmq.REP)
+        try:
+            self._socket.bind(endpoint)
+        except zmq.ZMQError as e:
+            self._socket.close()
+            raise SensorNetProxyError("Can not create snapshot socket on '{0}': {1}".format(endpoint, e))
+
+    def get_sockets(self):
+        return [self._socket]
+
+    def handle_requests(self, sock):
+        """
+        Reply to all queued snapshot requests
+        """
+        while True:
+            try:
+                frames = sock.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            prefix = frames[0] if frames else b''
+            msgs = self._cache.snapshot(prefix)
+            logger.debug("Sending snapshot of {0} messages for prefix '{1}'".format(len(msgs), prefix))
+
+            reply = [str(len(msgs)).encode('ascii')]
+            for msg in msgs:
+                reply.append(make_topic(msg))
+                reply.append(self._encoding.encode(msg))
+            sock.send_multipart(reply)
+
+    def close(self):
+        self._socket.close()
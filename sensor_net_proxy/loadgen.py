@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Load generator emulating MySensors Ethernet gateways, measuring throughput, loss and latency
+of a running proxy end to end.
+
+Run as 'python3 -m sensor_net_proxy.loadgen' against a proxy listening on loopback, e.g.
+'sensor-net-proxy.py -i lo --no-dynamic-discovery --no-debug-log'.
+
+Each emulated gateway has its own UDP socket. SET messages carry the wall clock time of sending
+as the payload, so the paired ZMQ subscriber can compute the latency.
+"""
+
+import argparse
+import random
+import resource
+import socket
+import threading
+import time
+
+import zmq
+
+from sensor_net_proxy.encoding import ENCODINGS, decode_multipart
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+# number of sending rounds per second
+TICKS_PER_SECOND = 1000
+
+
+class EmulatedGateways(object):
+    """
+    Emulated gateways sending messages of their nodes to the proxy.
+    """
+
+    def __init__(self, count, nodes_per_gateway, proxy_address, internal_ratio=0.1, seed=0):
+        """
+        :param count: number of gateways
+        :param nodes_per_gateway: number of nodes behind each gateway
+        :param proxy_address: (address, port) of the proxy
+        :param internal_ratio: ratio of INTERNAL battery level messages among the sent messages
+        :param seed: seed of the random choice of gateways and messages
+        """
+        _raise_file_limit(count + 64)
+        self._sockets = []
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind((proxy_address[0], 0))
+            self._sockets.append(sock)
+        self._nodes_per_gateway = nodes_per_gateway
+        self._proxy_address = proxy_address
+        self._internal_ratio = internal_ratio
+        self._random = random.Random(seed)
+        self.sent = 0
+
+    def discover(self, broadcast_address):
+        """
+        Send the dynamic discovery request from all gateways
+        """
+        request = MySensorsMsg(MySensorsMsg.NODE_ID_BROADCAST, MySensorsMsg.NODE_ID_BROADCAST,
+                               MySensorsMsg.MSG_TYPE_INTERNAL, 0,
+                               MySensorsMsg.INTERNAL_TYPE_CONTROLLER_DISCOVERY, '').to_serial_msg()
+        for sock in self._sockets:
+            sock.sendto(request, (broadcast_address, self._proxy_address[1]))
+
+    def send(self, count):
+        """
+        Send messages from randomly chosen gateways
+        """
+        rand = self._random
+        for _ in range(count):
+            gw_index = rand.randrange(len(self._sockets))
+            node_id = (gw_index * self._nodes_per_gateway + rand.randrange(self._nodes_per_gateway)) % 254 + 1
+            if rand.random() < self._internal_ratio:
+                data = b'%d;255;3;0;0;%d\n' % (node_id, rand.randrange(101))
+            else:
+                data = b'%d;1;1;0;24;%.6f\n' % (node_id, time.time())
+            self._sockets[gw_index].sendto(data, self._proxy_address)
+        self.sent += count
+
+    def close(self):
+        for sock in self._sockets:
+            sock.close()
+
+
+class Subscriber(threading.Thread):
+    """
+    Thread receiving the published messages and collecting latencies of SET messages.
+    """
+
+    def __init__(self, endpoint, encoding, topic=True):
+        super(Subscriber, self).__init__(name='subscriber')
+        self.daemon = True
+        self._zmq_ctx = zmq.Context()
+        self._socket = self._zmq_ctx.socket(zmq.SUB)
+        self._socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self._socket.setsockopt(zmq.RCVTIMEO, 100)
+        self._socket.connect(endpoint)
+        self._encoding = encoding
+        self._topic = topic
+        self._stopping = threading.Event()
+        self.received = 0
+        self.latencies = []
+        self.first = None
+        self.last = None
+
+    def run(self):
+        sock = self._socket
+        while not self._stopping.is_set():
+            try:
+                frames = sock.recv_multipart()
+            except zmq.Again:
+                continue
+            now = time.time()
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self.received += 1
+            # the message is the last frame, after the topic and offset frames if there are any
+            fields = decode_multipart(self._encoding, frames)
+            if fields['message_type'] == MySensorsMsg.MSG_TYPE_SET and \
+                    fields['sub_type'] == MySensorsMsg.SET_REQ_VALUE_VAR1:
+                self.latencies.append(now - float(fields['payload']))
+        sock.close()
+        self._zmq_ctx.term()
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def _raise_file_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    if hard != resource.RLIM_INFINITY:
+        needed = min(needed, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+def percentile(values, fraction):
+    """
+    Return the value at the given fraction of sorted values
+    """
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Load generator emulating MySensors Ethernet gateways',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--proxy-address', default='127.0.0.1', help='Address the proxy listens on')
+    parser.add_argument('-p', '--port', type=int, default=5003, help='Port the proxy listens on')
+    parser.add_argument('--broadcast-address', default=None,
+                        help='Address to send dynamic discovery requests to, no requests are sent if not given')
+    parser.add_argument('--publish-endpoint', default='tcp://127.0.0.1:5556', help='Endpoint of the proxy publisher')
+    parser.add_argument('--zmq-format', default='json', choices=sorted(ENCODINGS),
+                        help='Format of the published messages')
+    parser.add_argument('--no-zmq-topic', default=True, action='store_false', dest='zmq_topic',
+                        help='The proxy publishes messages without the topic frame')
+    parser.add_argument('-g', '--gateways', type=int, default=1000, help='Number of emulated gateways')
+    parser.add_argument('--nodes-per-gateway', type=int, default=4, help='Number of nodes behind each gateway')
+    parser.add_argument('-r', '--rate', type=float, default=10000, help='Messages sent per second')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Number of seconds to send messages')
+    parser.add_argument('--internal-ratio', type=float, default=0.1,
+                        help='Ratio of INTERNAL battery level messages, the rest are SET messages')
+    parser.add_argument('--drain', type=float, default=2, help='Number of seconds to wait for late messages')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random traffic')
+    conf = parser.parse_args(args)
+
+    subscriber = Subscriber(conf.publish_endpoint, conf.zmq_format, conf.zmq_topic)
+    subscriber.start()
+    gateways = EmulatedGateways(conf.gateways, conf.nodes_per_gateway, (conf.proxy_address, conf.port),
+                                conf.internal_ratio, conf.seed)
+    # let the subscriber connect
+    time.sleep(0.5)
+    if conf.broadcast_address:
+        gateways.discover(conf.broadcast_address)
+
+    total = int(conf.rate * conf.duration)
+    ticks = int(conf.duration * TICKS_PER_SECOND)
+    start = time.monotonic()
+    for tick in range(1, ticks + 1):
+        gateways.send(total * tick // ticks - gateways.sent)
+        delay = start + tick / float(TICKS_PER_SECOND) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.monotonic() - start
+    time.sleep(conf.drain)
+    subscriber.stop()
+    gateways.close()
+
+    latencies = sorted(subscriber.latencies)
+    lost = gateways.sent - subscriber.received
+    receiving = (subscriber.last - subscriber.first) if subscriber.received > 1 else float('nan')
+    print('sent            {0:>12,} messages in {1:.2f} s ({2:,.0f} msg/s)'.format(
+        gateways.sent, elapsed, gateways.sent / elapsed))
+    print('received        {0:>12,} messages in {1:.2f} s ({2:,.0f} msg/s)'.format(
+        subscriber.received, receiving, subscriber.received / receiving if receiving else float('nan')))
+    print('lost            {0:>12,} messages ({1:.2%})'.format(lost, lost / float(gateways.sent or 1)))
+    print('latency p50     {0:>12.3f} ms'.format(percentile(latencies, 0.5) * 1000))
+    print('latency p99     {0:>12.3f} ms'.format(percentile(latencies, 0.99) * 1000))
+    print('latency max     {0:>12.3f} ms'.format(latencies[-1] * 1000 if latencies else float('nan')))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,11 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import atexit
 import logging
+import logging.handlers
+import queue
+import time
 
 
 class LoggerHelper(object):
@@ -68,6 +72,107 @@ class LoggerHelper(object):
             file_handler.setFormatter(formatter)
         logger.addHandler(file_handler)
 
+    # listeners of queued handlers, stopped at exit so the queued records are written
+    _listeners = []
+
+    @staticmethod
+    def add_queued_file_handler(logger, path, formatter=None, level=None):
+        """
+        Adds FileHandler to a given logger, which writes records in a separate thread.
+        The logging thread only puts records to a queue.
+
+        :param logger: Logger object to which the file handler will be added
+        :param path: Path to file where the debug log will be written
+        :return: None
+        """
+        file_handler = logging.FileHandler(path, 'w')
+        if formatter:
+            file_handler.setFormatter(formatter)
+        queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+        if level:
+            queue_handler.setLevel(level)
+        listener = logging.handlers.QueueListener(queue_handler.queue, file_handler)
+        listener.start()
+        if not LoggerHelper._listeners:
+            atexit.register(LoggerHelper.stop_listeners)
+        LoggerHelper._listeners.append(listener)
+        logger.addHandler(queue_handler)
+
+    @staticmethod
+    def stop_listeners():
+        """
+        Write all queued records and stop threads of queued handlers
+        """
+        while LoggerHelper._listeners:
+            LoggerHelper._listeners.pop().stop()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler which leaves formatting of records to the listener thread.
+
+    The stock handler formats and copies every record in the logging thread, which is the receive loop.
+    Arguments of the records must therefore not be changed after logging them.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # the traceback is formatted while the frames are still alive
+            return logging.handlers.QueueHandler.prepare(self, record)
+        return record
+
+
+class SummaryLog(object):
+    """
+    Periodically logs a single line with counts of handled messages, instead of a line per message.
+
+    The line is logged every given number of seconds or counted messages, whichever comes first,
+    and only if some message was counted.
+    """
+
+    def __init__(self, logger, interval=60.0, every=0, clock=time.monotonic):
+        """
+        :param logger: logger to log the summary to
+        :param interval: number of seconds between summaries, 0 to disable
+        :param every: number of counted messages between summaries, 0 to disable
+        :param clock: function returning the current time in seconds
+        """
+        self._logger = logger
+        self.interval = interval
+        self.every = every
+        self._clock = clock
+        self._counters = {}
+        self._count = 0
+        self._start = clock()
+
+    def add(self, name, count=1):
+        """
+        Count messages
+
+        :param name: what happened to the messages, e.g. 'received'
+        :param count: number of messages
+        """
+        self._counters[name] = self._counters.get(name, 0) + count
+        self._count += count
+        if self.every and self._count >= self.every:
+            self.report()
+
+    def tick(self):
+        """
+        Log the summary if the interval elapsed. Should be called periodically.
+        """
+        if self.interval and self._clock() - self._start >= self.interval:
+            self.report()
+
+    def report(self):
+        now = self._clock()
+        if self._count:
+            self._logger.info('In last %.1f s: %s', now - self._start,
+                              ', '.join('{0} {1}'.format(count, name) for name, count in self._counters.items()))
+        self._counters = {}
+        self._count = 0
+        self._start = now
+
 
 #  the main TP Controller logger
 logger = LoggerHelper.get_basic_logger('sensor-net-proxy')
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+In-process metrics exposed in the Prometheus text format.
+
+Most metrics are read from the statistics attributes the components already keep, when
+the metrics are scraped, so they cost nothing on the hot path. Only histograms are updated
+by the components directly.
+"""
+
+import bisect
+import http.server
+import threading
+
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger
+
+# buckets of latency histograms in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(label_names, label_values):
+    return '{' + ','.join('{0}="{1}"'.format(name, value) for name, value in zip(label_names, label_values)) + '}'
+
+
+class Metric(object):
+    """
+    Counter or gauge whose value is returned by a function when the metrics are scraped.
+    """
+
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+
+    def __init__(self, name, help_text, metric_type, func, label_names=()):
+        """
+        :param name: name of the metric
+        :param help_text: description of the metric
+        :param metric_type: COUNTER or GAUGE
+        :param func: function returning the value, or a dictionary mapping tuples of label values
+                     to values if the metric has labels
+        :param label_names: names of the labels
+        """
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self._func = func
+        self._label_names = label_names
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text),
+                 '# TYPE {0} {1}'.format(self.name, self.metric_type)]
+        if self._label_names:
+            for label_values, value in sorted(self._func().items()):
+                lines.append('{0}{1} {2}'.format(self.name, _format_labels(self._label_names, label_values), value))
+        else:
+            lines.append('{0} {1}'.format(self.name, self._func()))
+        return lines
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets. Should be updated only from a single thread.
+    """
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """
+        :param name: name of the metric
+        :param help_text: description of the metric
+        :param buckets: sorted upper bounds of the buckets
+        """
+        self.name = name
+        self.help_text = help_text
+        self._buckets = tuple(buckets)
+        # the last item counts values above the highest bucket
+        self._counts = [0] * (len(self._buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_many(self, value, count):
+        """
+        Observe the same value multiple times
+        """
+        self._counts[bisect.bisect_left(self._buckets, value)] += count
+        self.sum += value * count
+        self.count += count
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text),
+                 '# TYPE {0} histogram'.format(self.name)]
+        counts = list(self._counts)
+        cumulative = 0
+        for bound, count in zip(self._buckets, counts):
+            cumulative += count
+            lines.append('{0}_bucket{{le="{1}"}} {2}'.format(self.name, bound, cumulative))
+        cumulative += counts[-1]
+        lines.append('{0}_bucket{{le="+Inf"}} {1}'.format(self.name, cumulative))
+        lines.append('{0}_sum {1}'.format(self.name, self.sum))
+        lines.append('{0}_count {1}'.format(self.name, cumulative))
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    Registry of metrics rendered together in the Prometheus text format.
+    """
+
+    PREFIX = 'sensor_net_proxy_'
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, func, label_names=()):
+        return self._add(Metric(self.PREFIX + name, help_text, Metric.COUNTER, func, label_names))
+
+    def gauge(self, name, help_text, func, label_names=()):
+        return self._add(Metric(self.PREFIX + name, help_text, Metric.GAUGE, func, label_names))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.PREFIX + name, help_text, buckets))
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def read_udp_errors(path='/proc/net/snmp'):
+    """
+    Return dictionary with system wide counters of UDP errors, e.g. datagrams dropped by the kernel
+    because of full receive buffers. Empty if the counters are not available.
+    """
+    try:
+        with open(path) as f:
+            udp = [line.split()[1:] for line in f if line.startswith('Udp:')]
+    except (IOError, OSError):
+        return {}
+    if len(udp) != 2:
+        return {}
+    return {(name,): int(value) for name, value in zip(*udp) if name.endswith('Errors')}
+
+
+class MetricsServer(object):
+    """
+    HTTP server exposing the metrics on /metrics, running in a separate thread.
+    """
+
+    def __init__(self, registry, address, port, pages=None):
+        """
+        :param registry: MetricsRegistry
+        :param address: address to listen on
+        :param port: port to listen on
+        :param pages: dictionary mapping additional paths to functions returning text served on them
+        """
+        handlers = dict(pages or {})
+        handlers['/metrics'] = registry.render
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                handler = handlers.get(self.path.split('?')[0])
+                if handler is None:
+                    self.send_error(404)
+                    return
+                body = handler().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logger.debug('Metrics request from %s: %s', self.address_string(), fmt % args)
+
+        try:
+            self._server = http.server.ThreadingHTTPServer((address, port), Handler)
+        except (IOError, OSError) as e:
+            raise SensorNetProxyError("Can not create metrics endpoint on '{0}:{1}': {2}".format(address, port, e))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
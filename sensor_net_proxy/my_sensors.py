@@ -17,11 +17,16 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import collections
 import netifaces
 import socket
+import time
 
-from sensor_net_proxy.logger import logger
-from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.cache import ExpiringCache
+from sensor_net_proxy.datagram import DatagramReceiver, DatagramSender
+from sensor_net_proxy.logger import logger, logging
+from sensor_net_proxy.exceptions import SensorNetProxyError, MalformedMsgError
+from sensor_net_proxy.gateways import GatewayRegistry
 
 
 class MySensorsEthernetProxy(object):
@@ -29,52 +34,189 @@ class MySensorsEthernetProxy(object):
     Class representing a proxy for MySensors Ethernet Gateway.
     """
 
-    def __init__(self, interface, port=5003, dynamic_discovery=True):
+    def __init__(self, listen, dynamic_discovery=True, recv_batch_size=64, route_ttl=3600,
+                 route_max_size=256, gateway_ttl=3600, gateway_max_size=1024, check_sub_type=True,
+                 quarantine_size=64, rate_limiter=None, discovery_rate_limiter=None):
         """
 
-        :param interface:
+        :param listen: list of (interface, port) tuples to listen on
         :param dynamic_discovery:
+        :param recv_batch_size: maximum number of messages received from a socket at once
+        :param route_ttl: number of seconds after which the gateway a node was last heard from is forgotten
+        :param route_max_size: maximum number of nodes with known gateway
+        :param gateway_ttl: number of seconds after which a gateway which was not heard from is forgotten
+        :param gateway_max_size: maximum number of known gateways
+        :param check_sub_type: whether to reject received messages with sub-type not known for the message type
+        :param quarantine_size: number of the last rejected datagrams kept for inspection
+        :param rate_limiter: RateLimiter applied to messages from each source address, or None
+        :param discovery_rate_limiter: RateLimiter applied to discovery requests from each source address, or None
         :return None
         """
         self._listen_sockets = []
         self._listen_brcast_sockets = []
-        self._ethernet_gateways_addresses = []
+        self._ethernet_gateways = GatewayRegistry(gateway_ttl, gateway_max_size)
+        # (broadcast address, port) -> (listening address, listening socket)
         self._bcast_addr_to_listen_addr = {}
-        self._interface = interface
-        self._port = int(port)
+        # (interface, port) tuples without duplicates
+        self._listen = []
+        # (address, broadcast address, port) -> (listening socket, broadcast socket or None)
+        self._listen_addrs = {}
+        # node_id -> (gateway address, proxy socket) of the gateway the node was last heard from
+        self._node_routes = ExpiringCache(route_ttl, route_max_size)
         self._dynamic_discovery = dynamic_discovery
+        self._receiver = DatagramReceiver(recv_batch_size)
+        self._sender = DatagramSender()
+        self._check_sub_type = check_sub_type
+        # (time, client, raw message, reason) of the last rejected datagrams
+        self._quarantine = collections.deque(maxlen=quarantine_size)
+        self.rate_limiter = rate_limiter
+        self.discovery_rate_limiter = discovery_rate_limiter
+        # CaptureWriter recording the received datagrams, or None
+        self.capture = None
+        # statistics
+        self.datagrams_received = 0
+        self.bytes_received = 0
+        # message_type -> number of received messages
+        self.messages_received = {}
+        self.discovery_requests = 0
+        # reason -> number of rejected datagrams
+        self.rejected = {}
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+
+        for interface, port in listen:
+            if interface not in netifaces.interfaces():
+                raise SensorNetProxyError("Interface '{0}' does not exist. Existing interfaces are '{1}'".format(
+                    interface,
+                    str(netifaces.interfaces())))
+            if (interface, int(port)) not in self._listen:
+                self._listen.append((interface, int(port)))
+        if not self._listen:
+            raise SensorNetProxyError("No interface to listen on")
 
-        if interface not in netifaces.interfaces():
-            raise SensorNetProxyError("Interface '{0}' does not exist. Existing interfaces are '{1}'".format(
-                interface,
-                str(netifaces.interfaces())))
-
-        self._create_listening_sockets()
+        try:
+            for interface, port in self._listen:
+                self._create_listening_sockets(interface, port)
+        except SensorNetProxyError:
+            self.close_sockets()
+            raise
 
-    def _create_listening_sockets(self):
+    def _create_listening_sockets(self, interface, port):
         """
         Creates listening UDP socket for all addresses on the particular interface.
         """
-        logger.debug("Creating listening sockets interface '{0}'".format(self._interface))
-        # go through IPv4 addresses only
-        try:
-            for addrs in netifaces.ifaddresses(self._interface)[netifaces.AF_INET]:
-                logger.debug("Interface addresses '{0}'".format(addrs))
-                listen_sock = MySensorsEthernetProxy.create_listening_udp_socket(addrs['addr'], self._port)
-                self._listen_sockets.append(listen_sock)
-
-                if self._dynamic_discovery:
-                    try:
-                        self._listen_brcast_sockets.append(MySensorsEthernetProxy.create_listening_udp_socket(
-                            addrs['broadcast'], self._port))
-                        # mapping of broadcast address to the listening address
-                        self._bcast_addr_to_listen_addr[addrs['broadcast']] = (addrs['addr'], listen_sock)
-                    except KeyError:
-                        raise SensorNetProxyError("Using dynamic discovery, but the selected interface does not support"
-                                                  "broadcast!")
-        except KeyError:
+        logger.debug("Creating listening sockets interface '{0}' port {1}".format(interface, port))
+        addresses = MySensorsEthernetProxy.get_interface_addresses(interface)
+        if not addresses:
             raise SensorNetProxyError("The selected interface '{0}' does not have any "
-                                      "IPv4 address".format(self._interface))
+                                      "IPv4 address".format(interface))
+        for addrs in addresses:
+            logger.debug("Interface addresses '{0}'".format(addrs))
+            self._open_listening_address(interface, port, addrs)
+
+    @staticmethod
+    def get_interface_addresses(interface):
+        """
+        Return list of IPv4 address dictionaries of the interface, empty if the interface does not exist
+        """
+        try:
+            return netifaces.ifaddresses(interface).get(netifaces.AF_INET, [])
+        except ValueError:
+            return []
+
+    def _listening_key(self, port, addrs):
+        """
+        Return (address, broadcast address, port) tuple identifying sockets of the address
+        """
+        return addrs['addr'], addrs.get('broadcast') if self._dynamic_discovery else None, port
+
+    def _open_listening_address(self, interface, port, addrs):
+        """
+        Create the listening socket and if using dynamic discovery also the broadcast socket for the address
+
+        :return: list of created sockets
+        """
+        key = self._listening_key(port, addrs)
+        if self._dynamic_discovery and key[1] is None:
+            raise SensorNetProxyError("Using dynamic discovery, but the interface '{0}' does not support "
+                                      "broadcast!".format(interface))
+        listen_sock = MySensorsEthernetProxy.create_listening_udp_socket(addrs['addr'], port)
+        bcast_sock = None
+        if self._dynamic_discovery:
+            try:
+                bcast_sock = MySensorsEthernetProxy.create_listening_udp_socket(key[1], port)
+            except SensorNetProxyError:
+                listen_sock.close()
+                raise
+            self._listen_brcast_sockets.append(bcast_sock)
+            # mapping of broadcast address to the listening address
+            self._bcast_addr_to_listen_addr[(key[1], port)] = (addrs['addr'], listen_sock)
+        self._listen_sockets.append(listen_sock)
+        self._listen_addrs[key] = (listen_sock, bcast_sock)
+        return [s for s in (listen_sock, bcast_sock) if s is not None]
+
+    def _close_listening_address(self, key):
+        """
+        Close sockets of the address and forget gateways and routes using them
+
+        :return: list of closed sockets
+        """
+        address, broadcast, port = key
+        listen_sock, bcast_sock = self._listen_addrs.pop(key)
+        self._listen_sockets.remove(listen_sock)
+        if bcast_sock is not None:
+            self._listen_brcast_sockets.remove(bcast_sock)
+            if self._bcast_addr_to_listen_addr[(broadcast, port)][1] is listen_sock:
+                del self._bcast_addr_to_listen_addr[(broadcast, port)]
+                # another address in the same subnet answers the discovery requests from now on
+                for (other_address, other_broadcast, other_port), (other_sock, _) in self._listen_addrs.items():
+                    if (other_broadcast, other_port) == (broadcast, port):
+                        self._bcast_addr_to_listen_addr[(broadcast, port)] = (other_address, other_sock)
+                        break
+
+        for gw_addr, proxy_socket in self._ethernet_gateways.gateways():
+            if proxy_socket is listen_sock:
+                self._ethernet_gateways.remove(gw_addr)
+        for node_id, (_, proxy_socket) in self._node_routes.items():
+            if proxy_socket is listen_sock:
+                self._node_routes.pop(node_id)
+
+        closed = [s for s in (listen_sock, bcast_sock) if s is not None]
+        for s in closed:
+            s.close()
+        return closed
+
+    def update_listening_sockets(self, on_added, on_removed):
+        """
+        Create sockets for addresses added to the interfaces and close sockets of removed addresses.
+        Addresses which can not be listened on are skipped and tried again on the next update.
+
+        :param on_added: callable taking a newly created socket
+        :param on_removed: callable taking a socket which is about to be closed
+        """
+        wanted = {}
+        for interface, port in self._listen:
+            for addrs in MySensorsEthernetProxy.get_interface_addresses(interface):
+                wanted[self._listening_key(port, addrs)] = (interface, port, addrs)
+
+        for key in [key for key in self._listen_addrs if key not in wanted]:
+            for s in self._listen_addrs[key]:
+                if s is not None:
+                    on_removed(s)
+            self._close_listening_address(key)
+            logger.info("Stopped listening on '{0}:{1}'".format(key[0], key[2]))
+
+        for key, (interface, port, addrs) in wanted.items():
+            if key in self._listen_addrs:
+                continue
+            try:
+                added = self._open_listening_address(interface, port, addrs)
+            except SensorNetProxyError as e:
+                logger.error("Can not listen on '{0}:{1}': {2}".format(key[0], port, e))
+                continue
+            for s in added:
+                on_added(s)
+            logger.info("Listening on '{0}:{1}' of interface '{2}'".format(key[0], port, interface))
 
     @staticmethod
     def create_listening_udp_socket(address, port):
@@ -118,48 +260,173 @@ class MySensorsEthernetProxy(object):
     def handle_dynamic_discovery(self, sock):
         """
         Handle the dynamic discovery request.
-        """
-        raw_msg, client = sock.recvfrom(2**16)
-        logger.info("Received dynamic discovery request from '{0}'".format(client))
 
-        logger.debug("Received raw message '{0}'".format(raw_msg.strip()))
-        msg = MySensorsMsg.from_serial_msg(raw_msg.strip())
+        Raises BlockingIOError if there is no datagram queued on the socket.
+        """
+        raw_msg, client = sock.recvfrom(2**16, socket.MSG_DONTWAIT)
+        if self.discovery_rate_limiter is not None and not self.discovery_rate_limiter.allow(client[0]):
+            return
+        logger.debug("Received dynamic discovery request %r from '%s'", raw_msg, client)
+        self.discovery_requests += 1
+        try:
+            msg = MySensorsMsg.parse_valid(raw_msg, self._check_sub_type)
+        except MalformedMsgError as e:
+            self._reject(raw_msg, client, str(e))
+            return
 
         if msg.message_type != MySensorsMsg.MSG_TYPE_INTERNAL or msg.sub_type != MySensorsMsg.INTERNAL_TYPE_CONTROLLER_DISCOVERY:
             logger.warning("Bogus msg received... type='{0}'".format(
                 MySensorsMsg.msg_type_to_str(msg.message_type)))
             return
 
-        listen_addr, listen_sock = self._bcast_addr_to_listen_addr[sock.getsockname()[0]]
+        listen_addr, listen_sock = self._bcast_addr_to_listen_addr[sock.getsockname()]
         msg.payload = '{0}'.format(listen_addr)
 
-        logger.debug("Sending raw message '{0}' to '{1}'".format(msg.to_serial_msg().strip(), client))
-        listen_sock.sendto(msg.to_serial_msg(), client)
+        serial_msg = msg.to_serial_msg()
+        logger.debug("Sending raw message %r to '%s'", serial_msg, client)
+        listen_sock.sendto(serial_msg, client)
+        self.datagrams_sent += 1
+        self.bytes_sent += len(serial_msg)
+
+        # add the gateway address to the registry of gateways
+        if self._ethernet_gateways.update(client, listen_sock):
+            logger.info("Added gateway '{0}', {1} gateways known".format(client, len(self._ethernet_gateways)))
 
-        # add the gateway address to the list of gateways
-        self._ethernet_gateways_addresses.append((client, listen_sock))
+    @property
+    def recv_batch_size(self):
+        return self._receiver.batch_size
 
     def handle_incoming_msg(self, sock):
         """
-        Handle the incoming message.
+        Handle the incoming messages queued on the socket.
+
+        :return: list of (MySensorsMsg, client) tuples, at most recv_batch_size long
+        """
+        datagrams = self._receiver.recv_batch(sock)
+        for raw_msg, client in self._receiver.oversized:
+            self._reject(raw_msg, client, 'oversize')
+        if self.capture is not None:
+            self.capture.write(datagrams)
+        return self.handle_datagrams(datagrams, sock)
+
+    def handle_datagrams(self, datagrams, sock=None):
         """
-        # TODO: move this to separate method?
-        raw_msg, client = sock.recvfrom(2**16)
-        logger.info("Received message from '{0}'".format(client))
+        Handle the datagrams received from gateways
 
-        logger.debug("Received raw message '{0}'".format(raw_msg.strip()))
-        msg = MySensorsMsg.from_serial_msg(raw_msg.strip())
+        :param datagrams: list of (bytes, client) tuples
+        :param sock: socket on which the datagrams were received, None if they are replayed from a capture
+        :return: list of (MySensorsMsg, client) tuples
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            for raw_msg, client in datagrams:
+                logger.debug("Received raw message %r from '%s'", raw_msg, client)
+
+        self.datagrams_received += len(datagrams)
+        self.bytes_received += sum(len(raw_msg) for raw_msg, _ in datagrams)
+
+        parse = MySensorsMsg.parse_valid
+        check_sub_type = self._check_sub_type
+        rate_limiter = self.rate_limiter
+        messages_received = self.messages_received
+        msgs = []
+        for raw_msg, client in datagrams:
+            # drop floods before spending any time on parsing
+            if rate_limiter is not None and not rate_limiter.allow(client[0]):
+                continue
+            try:
+                msg = parse(raw_msg, check_sub_type)
+            except MalformedMsgError as e:
+                self._reject(raw_msg, client, str(e))
+                continue
+            messages_received[msg.message_type] = messages_received.get(msg.message_type, 0) + 1
+            if msg.node_id != MySensorsMsg.NODE_ID_BROADCAST and sock is not None:
+                self._node_routes.set(msg.node_id, (client, sock))
+            # keep gateways which are sending messages in the registry
+            self._ethernet_gateways.refresh(client)
+            msgs.append((msg, client))
+
+        return msgs
+
+    def _reject(self, raw_msg, client, reason):
+        """
+        Count the rejected datagram and keep it in the quarantine
+        """
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        self._quarantine.append((time.time(), client, bytes(raw_msg), reason))
+        logger.debug("Rejected message %r from '%s': %s", raw_msg, client, reason)
 
-        return msg, client
+    def get_quarantine(self):
+        """
+        Return list of (time, client, raw message, reason) tuples of the last rejected datagrams
+        """
+        return list(self._quarantine)
 
     def send_msg_to_gateway(self, msg):
         """
-        Send MySensorsMsg to the gateway
+        Send MySensorsMsg to the gateway the node was last heard from. If it is not known,
+        send it to all gateways.
         """
-        logger.info("Sending message '{0}' to gateways".format(msg.to_serial_msg().strip()))
-        for gw_addr, proxy_socket in self._ethernet_gateways_addresses:
-            logger.info("Sending message to gateway '{0}'".format(gw_addr))
-            proxy_socket.sendto(msg.to_serial_msg(), gw_addr)
+        self.send_serial_to_gateway(msg.node_id, msg.to_serial_msg())
+
+    def send_msg_to_client(self, msg, gw_addr, proxy_socket):
+        """
+        Send MySensorsMsg only to the gateway with the address, e.g. in response to its request
+        """
+        serial_msg = msg.to_serial_msg()
+        logger.debug("Sending raw message %r to gateway '%s'", serial_msg, gw_addr)
+        proxy_socket.sendto(serial_msg, gw_addr)
+        self.datagrams_sent += 1
+        self.bytes_sent += len(serial_msg)
+
+    def send_serial_to_gateway(self, node_id, serial_msg):
+        """
+        Send serial message for the node to the gateway the node was last heard from. If it is not known,
+        send it to all gateways.
+        """
+        route = self._node_routes.get(node_id)
+        if route is not None:
+            gw_addr, proxy_socket = route
+            logger.debug("Sending raw message %r to gateway '%s'", serial_msg, gw_addr)
+            proxy_socket.sendto(serial_msg, gw_addr)
+            self.datagrams_sent += 1
+            self.bytes_sent += len(serial_msg)
+            return
+
+        logger.debug("Sending raw message %r to %d gateways", serial_msg, len(self._ethernet_gateways))
+
+        # the same bytes are sent to all gateways behind one proxy socket in a single batch
+        gateways_by_socket = {}
+        for gw_addr, proxy_socket in self._ethernet_gateways.gateways():
+            gateways_by_socket.setdefault(proxy_socket, []).append(gw_addr)
+
+        for proxy_socket, gw_addrs in gateways_by_socket.items():
+            self._sender.send_batch(proxy_socket, serial_msg, gw_addrs)
+            self.datagrams_sent += len(gw_addrs)
+            self.bytes_sent += len(serial_msg) * len(gw_addrs)
+
+    def expire(self):
+        """
+        Forget gateways and gateways of nodes which were not heard from for too long
+        """
+        for node_id, (gw_addr, _) in self._node_routes.expire():
+            logger.debug("Route of node '{0}' via gateway '{1}' expired".format(node_id, gw_addr))
+        for gw_addr, _ in self._ethernet_gateways.expire():
+            logger.info("Gateway '{0}' expired, {1} gateways known".format(gw_addr, len(self._ethernet_gateways)))
+        for limiter in (self.rate_limiter, self.discovery_rate_limiter):
+            if limiter is not None:
+                limiter.expire()
+
+    def get_route_count(self):
+        """
+        Return number of nodes with known gateway
+        """
+        return len(self._node_routes)
+
+    def get_gateway_stats(self):
+        """
+        Return dictionary with size and churn statistics of the gateway registry
+        """
+        return self._ethernet_gateways.stats()
 
 
 class MySensorsMsg(object):
@@ -168,6 +435,9 @@ class MySensorsMsg(object):
     http://www.mysensors.org/download/serial_api_14
     """
 
+    # Node ID used by nodes without assigned ID and for messages to all nodes
+    NODE_ID_BROADCAST = 255
+
     # Message Type
     MSG_TYPE_PRESENTATION = 0
     MSG_TYPE_SET = 1
@@ -271,6 +541,13 @@ class MySensorsMsg(object):
     STREAM_TYPE_SOUND = 4
     STREAM_TYPE_IMAGE = 5
 
+    # highest known sub-type of each message type
+    MAX_SUB_TYPE = {MSG_TYPE_PRESENTATION: SENSOR_TYPE_SCENE_CONTROLLER,
+                    MSG_TYPE_SET: SET_REQ_VALUE_CURRENT,
+                    MSG_TYPE_REQ: SET_REQ_VALUE_CURRENT,
+                    MSG_TYPE_INTERNAL: INTERNAL_TYPE_CONTROLLER_DISCOVERY,
+                    MSG_TYPE_STREAM: STREAM_TYPE_IMAGE}
+
     # Payload type
     PAYLOAD_STRING = 0
     PAYLOAD_BYTE = 1
@@ -281,33 +558,130 @@ class MySensorsMsg(object):
     PAYLOAD_CUSTOM = 6
     PAYLOAD_FLOAT32 = 7
 
+    __slots__ = ('node_id', 'child_sensor_id', 'message_type', 'ack', 'sub_type', '_payload', '_raw_payload',
+                 '_serial')
+
     def __init__(self, node_id, child_sensor_id, message_type, ack, sub_type, payload):
         self.node_id = int(node_id)
         self.child_sensor_id = int(child_sensor_id)
         self.message_type = int(message_type)
         self.ack = int(ack)
         self.sub_type = int(sub_type)
-        self.payload = payload.decode()
+        self._serial = None
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            # decoded lazily on the first access
+            self._payload = None
+            self._raw_payload = bytes(payload)
+        else:
+            self._payload = str(payload)
+            self._raw_payload = None
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            # received payload may be anything, it must not break publishing
+            self._payload = self._raw_payload.decode('utf-8', 'replace')
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = value
+        self._raw_payload = None
+
+    def to_dict(self):
+        """
+        Return dictionary with all message fields
+        """
+        return {'node_id': self.node_id,
+                'child_sensor_id': self.child_sensor_id,
+                'message_type': self.message_type,
+                'ack': self.ack,
+                'sub_type': self.sub_type,
+                'payload': self.payload}
 
     def to_serial_msg(self):
         """
-        Construct the serial message
+        Construct the serial message. The result is cached together with the fields it was
+        built from, so it is rebuilt only after some field changes.
 
         :return: string with serial message
         """
-        return bytes('{node_id};{child_sensor_id};{message_type};{ack};{sub_type};{payload}\n'.format(**self.__dict__),
-                     'utf-8')
+        fields = (self.node_id, self.child_sensor_id, self.message_type, self.ack, self.sub_type, self.payload)
+        if self._serial is None or self._serial[0] != fields:
+            self._serial = (fields, bytes('{0};{1};{2};{3};{4};{5}\n'.format(*fields), 'utf-8'))
+        return self._serial[1]
 
     @staticmethod
     def from_serial_msg(message):
         """
         Parses the serial message
 
-        :param message: string with serial message 'node-id;child-sensor-id;message-type;ack;sub-type;payload\n'
+        :param message: bytes or memoryview with serial message
+                        'node-id;child-sensor-id;message-type;ack;sub-type;payload\n'
         :return: MySensorsMsg object
         """
-        logger.debug("Parsing MySensors message '{0}'".format(message.strip()))
-        return MySensorsMsg(*message.strip().split(b';'))
+        if isinstance(message, memoryview):
+            message = message.tobytes()
+        node_id, child_sensor_id, message_type, ack, sub_type, payload = message.strip().split(b';', 5)
+
+        # fast path skipping the generic conversions done in __init__
+        msg = object.__new__(MySensorsMsg)
+        msg.node_id = int(node_id)
+        msg.child_sensor_id = int(child_sensor_id)
+        msg.message_type = int(message_type)
+        msg.ack = int(ack)
+        msg.sub_type = int(sub_type)
+        msg._payload = None
+        msg._raw_payload = payload
+        msg._serial = None
+        return msg
+
+    @staticmethod
+    def parse_valid(message, check_sub_type=True):
+        """
+        Parses the serial message received from the network and checks that its fields are in range
+
+        :param message: bytes or memoryview with serial message
+        :param check_sub_type: whether to reject sub-types not known for the message type
+        :return: MySensorsMsg object
+        :raises MalformedMsgError: with the reason of rejecting the message
+        """
+        try:
+            msg = MySensorsMsg.from_serial_msg(message)
+        except ValueError:
+            raise MalformedMsgError('malformed')
+        msg.check_fields(check_sub_type)
+        return msg
+
+    def check_fields(self, check_sub_type=True):
+        """
+        Checks that fields of the message are in range, so it can be sent to the network
+
+        :param check_sub_type: whether to reject sub-types not known for the message type
+        :raises MalformedMsgError: with the reason of rejecting the message
+        """
+        if not 0 <= self.node_id <= 255:
+            raise MalformedMsgError('node_id')
+        if not 0 <= self.child_sensor_id <= 255:
+            raise MalformedMsgError('child_sensor_id')
+        max_sub_type = MySensorsMsg.MAX_SUB_TYPE.get(self.message_type)
+        if max_sub_type is None:
+            raise MalformedMsgError('message_type')
+        if self.ack not in (0, 1):
+            raise MalformedMsgError('ack')
+        if self.sub_type < 0 or (check_sub_type and self.sub_type > max_sub_type) or self.sub_type > 255:
+            raise MalformedMsgError('sub_type')
+
+    @staticmethod
+    def parse_many(buffers):
+        """
+        Parses a batch of serial messages
+
+        :param buffers: iterable of bytes or memoryview objects with serial messages
+        :return: list of MySensorsMsg objects
+        """
+        parse = MySensorsMsg.from_serial_msg
+        return [parse(b) for b in buffers]
 
     @staticmethod
     def msg_type_to_str(msg_type):
@@ -345,3 +719,4 @@ class MySensorsMsg(object):
             return string[msg_type]
         except KeyError:
             return 'Bogus type'
+
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import socket
+
+from sensor_net_proxy.logger import logger
+
+# rtnetlink multicast groups, see linux/rtnetlink.h
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+
+class InterfaceWatcher(object):
+    """
+    Calls the callback when addresses of network interfaces may have changed.
+
+    Where available, rtnetlink notifications about links and IPv4 addresses are used. The notifications
+    are not parsed, the callback is expected to compare the current addresses with the known ones.
+    Otherwise the callback is called periodically.
+    """
+
+    MODES = ('auto', 'poll', 'off')
+
+    def __init__(self, engine, callback, poll_interval=5.0, use_netlink=True):
+        """
+        :param engine: engine running the proxy
+        :param callback: callable without arguments
+        :param poll_interval: number of seconds between calls of the callback if rtnetlink is not used
+        :param use_netlink: whether to use rtnetlink if available
+        """
+        self._callback = callback
+        self._socket = self._open_netlink_socket() if use_netlink else None
+        # statistics
+        self.changes = 0
+
+        if self._socket is not None:
+            logger.debug('Watching interfaces using rtnetlink')
+            engine.add_reader(self._socket, self._on_readable)
+        else:
+            logger.debug("Polling interfaces every {0} seconds".format(poll_interval))
+            engine.call_periodically(poll_interval, callback)
+
+    @staticmethod
+    def _open_netlink_socket():
+        """
+        Return socket subscribed to rtnetlink notifications or None if rtnetlink is not available
+        """
+        if not hasattr(socket, 'AF_NETLINK'):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        except (OSError, AttributeError) as e:
+            logger.info("rtnetlink is not available, polling interfaces: {0}".format(e))
+            return None
+        try:
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+            sock.setblocking(False)
+        except OSError as e:
+            logger.info("rtnetlink is not available, polling interfaces: {0}".format(e))
+            sock.close()
+            return None
+        return sock
+
+    def _on_readable(self, sock):
+        """
+        Drain all queued notifications and call the callback once
+        """
+        while True:
+            try:
+                sock.recv(2**16)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                # ENOBUFS when notifications were lost, the callback rescans everything anyway
+                logger.debug("rtnetlink error: {0}".format(e))
+                break
+        self.changes += 1
+        self._callback()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
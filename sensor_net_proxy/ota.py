@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Over-the-air firmware updates of nodes served by the proxy.
+
+Firmware images are binary files named '<type>-<version>.bin' in the firmware directory,
+where type and version are decimal numbers. A node asking for the firmware configuration
+gets the highest version of its firmware type.
+"""
+
+import mmap
+import os
+import re
+import struct
+
+from sensor_net_proxy.cache import ExpiringCache
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+# number of firmware bytes in a single response
+FIRMWARE_BLOCK_SIZE = 16
+# images are padded to a multiple of this size, the same as the bootloader expects
+FIRMWARE_PAD_SIZE = 128
+
+# payload structures are little endian, as on the nodes
+_CONFIG = struct.Struct('<HHHH')
+_REQUEST = struct.Struct('<HHH')
+
+_IMAGE_NAME = re.compile(r'^(\d+)-(\d+)\.bin$')
+
+
+def crc16(data):
+    """
+    Return CRC-16 of the data as computed by the bootloader
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def _serial_suffix(sub_type, payload):
+    """
+    Return the part of a serial stream message following the node ID
+    """
+    return ';{0};{1};0;{2};{3}\n'.format(MySensorsMsg.NODE_ID_BROADCAST, MySensorsMsg.MSG_TYPE_STREAM,
+                                         sub_type, payload.hex().upper()).encode('ascii')
+
+
+class FirmwareImage(object):
+    """
+    Firmware image split into ready to send responses to block requests.
+
+    The responses lack only the node ID at the beginning.
+    """
+
+    def __init__(self, fw_type, version, path):
+        self.fw_type = fw_type
+        self.version = version
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    raise SensorNetProxyError("Firmware image '{0}' is empty".format(path))
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    padding = -len(data) % FIRMWARE_PAD_SIZE
+                    image = data[:] + b'\xff' * padding
+        except (IOError, OSError, ValueError) as e:
+            raise SensorNetProxyError("Can not load firmware image '{0}': {1}".format(path, e))
+
+        self.blocks = len(image) // FIRMWARE_BLOCK_SIZE
+        if self.blocks > 0xFFFF:
+            raise SensorNetProxyError("Firmware image '{0}' is too big".format(path))
+        self.crc = crc16(image)
+        self.config_response = _serial_suffix(MySensorsMsg.STREAM_TYPE_FIRMWARE_CONFIG_RESPONSE,
+                                              _CONFIG.pack(fw_type, version, self.blocks, self.crc))
+        self._block_responses = [
+            _serial_suffix(MySensorsMsg.STREAM_TYPE_FIRMWARE_RESPONSE,
+                           _REQUEST.pack(fw_type, version, block) +
+                           image[block * FIRMWARE_BLOCK_SIZE:(block + 1) * FIRMWARE_BLOCK_SIZE])
+            for block in range(self.blocks)]
+
+    def block_response(self, block):
+        """
+        Return the response to the block request or None if there is no such block
+        """
+        if 0 <= block < self.blocks:
+            return self._block_responses[block]
+        return None
+
+
+class FirmwareStore(object):
+    """
+    Firmware images from a directory, loaded on demand. At most max_images images
+    are kept loaded, the least recently used one is dropped first.
+
+    The highest version of each firmware type is indexed, the directory is scanned
+    again only when its modification time changes.
+    """
+
+    def __init__(self, directory, max_images=8):
+        if not os.path.isdir(directory):
+            raise SensorNetProxyError("Firmware directory '{0}' does not exist".format(directory))
+        self._directory = directory
+        # (type, version) -> FirmwareImage
+        self._images = ExpiringCache(max_size=max_images)
+        # type -> highest version
+        self._latest = {}
+        self._mtime = None
+        # statistics
+        self.loaded = 0
+        self.refresh()
+
+    def refresh(self):
+        """
+        Scan the directory again if it changed since the last scan
+        """
+        try:
+            mtime = os.stat(self._directory).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            names = os.listdir(self._directory)
+        except OSError as e:
+            logger.error("Can not scan firmware directory '{0}': {1}".format(self._directory, e))
+            return
+        latest = {}
+        for name in names:
+            match = _IMAGE_NAME.match(name)
+            if match:
+                fw_type, version = int(match.group(1)), int(match.group(2))
+                if version > latest.get(fw_type, -1):
+                    latest[fw_type] = version
+        self._latest = latest
+        self._mtime = mtime
+
+    def latest_version(self, fw_type):
+        """
+        Return the highest version of the firmware type in the directory or None
+        """
+        return self._latest.get(fw_type)
+
+    def get(self, fw_type, version):
+        """
+        Return the FirmwareImage or None if there is no such image
+        """
+        key = (fw_type, version)
+        image = self._images.get(key)
+        if image is None:
+            path = os.path.join(self._directory, '{0}-{1}.bin'.format(fw_type, version))
+            if not os.path.exists(path):
+                return None
+            image = FirmwareImage(fw_type, version, path)
+            self.loaded += 1
+            logger.info("Loaded firmware type {0} version {1}, {2} blocks".format(fw_type, version, image.blocks))
+        # keep the least recently used image first
+        self._images.set(key, image)
+        return image
+
+    def __len__(self):
+        return len(self._images)
+
+
+class OtaServer(object):
+    """
+    Answers firmware configuration and block requests of nodes from the FirmwareStore.
+    Requests for firmware which is not in the store are left to the controller.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        # statistics
+        self.config_responses = 0
+        self.block_responses = 0
+
+    def refresh(self):
+        """
+        Pick up firmware images added to or removed from the store directory
+        """
+        self._store.refresh()
+
+    def handle(self, msg):
+        """
+        Return serial response to the stream message or None if it should be forwarded to the controller
+        """
+        if msg.message_type != MySensorsMsg.MSG_TYPE_STREAM:
+            return None
+        try:
+            if msg.sub_type == MySensorsMsg.STREAM_TYPE_FIRMWARE_REQUEST:
+                fw_type, version, block = _REQUEST.unpack(bytes.fromhex(msg.payload)[:_REQUEST.size])
+                image = self._store.get(fw_type, version)
+                response = image.block_response(block) if image is not None else None
+                if response is not None:
+                    self.block_responses += 1
+            elif msg.sub_type == MySensorsMsg.STREAM_TYPE_FIRMWARE_CONFIG_REQUEST:
+                fw_type = _CONFIG.unpack(bytes.fromhex(msg.payload)[:_CONFIG.size])[0]
+                version = self._store.latest_version(fw_type)
+                image = self._store.get(fw_type, version) if version is not None else None
+                response = image.config_response if image is not None else None
+                if response is not None:
+                    self.config_responses += 1
+                    logger.info("Node {0} asked for firmware type {1}, offering version {2}".format(
+                        msg.node_id, fw_type, version))
+            else:
+                return None
+        except (ValueError, struct.error) as e:
+            logger.warning("Malformed firmware request from node {0}: {1}".format(msg.node_id, e))
+            return None
+        except SensorNetProxyError as e:
+            logger.error(str(e))
+            return None
+
+        if response is None:
+            return None
+        return b'%d' % msg.node_id + response
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import collections
+import threading
+import time
+
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger
+
+
+class BoundedQueue(object):
+    """
+    Bounded FIFO queue passing batches of items between threads.
+
+    Items are added and removed in batches, so the lock is taken once per batch.
+    """
+
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    BLOCK = 'block'
+    POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+    def __init__(self, max_size, policy=DROP_OLDEST):
+        """
+        :param max_size: maximum number of items in the queue
+        :param policy: what to do when the queue is full. Drop the oldest queued items,
+                       drop the new items or block until there is enough space.
+        """
+        if policy not in BoundedQueue.POLICIES:
+            raise SensorNetProxyError("Unknown queue overflow policy '{0}'. Known policies are '{1}'".format(
+                policy, str(BoundedQueue.POLICIES)))
+        if max_size < 1:
+            raise SensorNetProxyError("Queue size must be at least 1")
+        self.max_size = max_size
+        self.policy = policy
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        # number of dropped items
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_many(self, items):
+        """
+        Add items to the queue, applying the overflow policy if it is full.
+
+        :param items: list of items
+        :return: number of items which were dropped
+        """
+        dropped = 0
+        with self._lock:
+            if self._closed:
+                return len(items)
+
+            overflow = len(self._items) + len(items) - self.max_size
+            if overflow > 0:
+                if self.policy == BoundedQueue.DROP_OLDEST:
+                    for _ in range(min(overflow, len(self._items))):
+                        self._items.popleft()
+                    if len(items) > self.max_size:
+                        items = items[-self.max_size:]
+                    dropped = overflow
+                elif self.policy == BoundedQueue.DROP_NEWEST:
+                    items = items[:len(items) - overflow]
+                    dropped = overflow
+                else:
+                    for i, item in enumerate(items):
+                        while len(self._items) >= self.max_size and not self._closed:
+                            self._not_full.wait()
+                        if self._closed:
+                            # the rest is dropped when the queue is closed while waiting
+                            dropped = len(items) - i
+                            self.dropped += dropped
+                            return dropped
+                        self._items.append(item)
+                        self._not_empty.notify()
+                    return 0
+
+            self._items.extend(items)
+            self.dropped += dropped
+            if items:
+                self._not_empty.notify()
+        return dropped
+
+    def get_batch(self, max_items, timeout=None):
+        """
+        Remove and return up to max_items items, waiting until some item is available.
+
+        :param max_items: maximum number of returned items
+        :param timeout: maximum number of seconds to wait, None to wait until the queue is closed
+        :return: list of items, empty if the timeout expired or the queue is closed and empty
+        """
+        with self._lock:
+            if not self._items and not self._closed:
+                self._not_empty.wait(timeout)
+            items = self._items
+            batch = [items.popleft() for _ in range(min(max_items, len(items)))]
+            if batch:
+                self._not_full.notify_all()
+            return batch
+
+    def close(self):
+        """
+        Wake up all waiting threads. Items can not be added to the closed queue.
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class PublisherThread(threading.Thread):
+    """
+    Thread publishing messages from the queue in batches.
+    """
+
+    def __init__(self, queue, zmq_proxy, batch_size=64, latency=None, clock=time.monotonic):
+        """
+        :param queue: BoundedQueue with (MySensorsMsg, time of receiving or None) tuples
+        :param zmq_proxy: ZmqProxy used only by this thread
+        :param batch_size: maximum number of messages taken from the queue at once
+        :param latency: Histogram of the time from receiving to publishing messages, updated only by this thread
+        :param clock: function returning the current time in seconds, the same as used for the time of receiving
+        """
+        super(PublisherThread, self).__init__(name='publisher')
+        self.daemon = True
+        self._queue = queue
+        self._zmq_proxy = zmq_proxy
+        self._batch_size = batch_size
+        self._latency = latency
+        self._clock = clock
+
+    def run(self):
+        queue = self._queue
+        publish = self._zmq_proxy.publish
+        while True:
+            batch = queue.get_batch(self._batch_size)
+            if not batch:
+                if queue.closed:
+                    break
+                continue
+            try:
+                for msg, received_at in batch:
+                    publish(msg)
+                    if self._latency is not None and received_at is not None:
+                        self._latency.observe(self._clock() - received_at)
+            except Exception:
+                logger.exception('Publishing of messages failed')
+
+    def stop(self, timeout=None):
+        """
+        Close the queue and wait until the remaining messages are published
+
+        :return: True if the thread exited, False if it is still publishing after the timeout
+        """
+        self._queue.close()
+        self.join(timeout)
+        return not self.is_alive()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+
+from sensor_net_proxy.cache import ExpiringCache
+from sensor_net_proxy.exceptions import SensorNetProxyError
+
+
+class RateLimiter(object):
+    """
+    Token bucket per source address.
+
+    Buckets are kept in a bounded table. A bucket which was not used for the time it takes
+    to fill up is the same as a missing one, so it expires. When the table is full,
+    the least recently used bucket is forgotten.
+    """
+
+    def __init__(self, rate, burst, max_sources=4096, clock=time.monotonic):
+        """
+        :param rate: number of messages per second allowed from a single source
+        :param burst: maximum number of messages allowed from a single source at once
+        :param max_sources: maximum number of tracked sources
+        :param clock: function returning the current time in seconds
+        """
+        if rate <= 0 or burst < 1:
+            raise SensorNetProxyError("Rate limit must be positive and burst at least 1")
+        self.rate = float(rate)
+        self.burst = burst
+        self._clock = clock
+        # source -> number of tokens at the time of the last update
+        self._buckets = ExpiringCache(burst / self.rate, max_sources, clock)
+        # number of rejected messages
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, source):
+        """
+        Take a token from the bucket of the source
+
+        :param source: source address
+        :return: True if the message from the source should be handled, False if it should be dropped
+        """
+        buckets = self._buckets
+        tokens = buckets.get(source)
+        if tokens is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, tokens + (self._clock() - buckets.get_timestamp(source)) * self.rate)
+
+        if tokens < 1:
+            buckets.set(source, tokens)
+            self.rejected += 1
+            return False
+        buckets.set(source, tokens - 1)
+        return True
+
+    def expire(self):
+        """
+        Forget buckets which are full again
+        """
+        self._buckets.expire()
+
+    @property
+    def evicted(self):
+        return self._buckets.evicted
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import calendar
+import json
+import os
+import time
+
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+# node IDs which can be assigned to nodes
+FIRST_NODE_ID = 1
+LAST_NODE_ID = 254
+
+
+class NodeIdAllocator(object):
+    """
+    Assigns unused node IDs. IDs of nodes seen in the network are treated as used.
+    The used IDs are stored in a JSON file, so they survive restarts.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._used = set()
+        self._dirty = False
+        try:
+            with open(path) as f:
+                self._used = set(int(node_id) for node_id in json.load(f)['used'])
+        except FileNotFoundError:
+            pass
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            raise SensorNetProxyError("Can not load node IDs from '{0}': {1}".format(path, e))
+
+    def __len__(self):
+        return len(self._used)
+
+    def observe(self, node_id):
+        """
+        Mark the ID of a node seen in the network as used
+        """
+        if node_id not in self._used and FIRST_NODE_ID <= node_id <= LAST_NODE_ID:
+            self._used.add(node_id)
+            self._dirty = True
+
+    def allocate(self):
+        """
+        Return the lowest unused node ID and mark it as used, None if all IDs are used.
+        The state is saved immediately, so the ID is never assigned twice.
+        """
+        for node_id in range(FIRST_NODE_ID, LAST_NODE_ID + 1):
+            if node_id not in self._used:
+                self._used.add(node_id)
+                self._dirty = True
+                self.save()
+                return node_id
+        return None
+
+    def save(self):
+        """
+        Store the used IDs if they changed since the last save
+        """
+        if not self._dirty:
+            return
+        tmp_path = self._path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'used': sorted(self._used)}, f)
+            os.replace(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            logger.error("Can not save node IDs to '{0}': {1}".format(self._path, e))
+            return
+        self._dirty = False
+
+
+class InternalResponder(object):
+    """
+    Answers INTERNAL time, config and ID requests of nodes without involving controllers.
+    """
+
+    UNIT_METRIC = 'M'
+    UNIT_IMPERIAL = 'I'
+    UNITS = (UNIT_METRIC, UNIT_IMPERIAL)
+
+    def __init__(self, allocator, config=UNIT_METRIC, clock=time.time):
+        """
+        :param allocator: NodeIdAllocator
+        :param config: unit system sent as the config response
+        :param clock: function returning the current UTC time in seconds since the epoch
+        """
+        if config not in InternalResponder.UNITS:
+            raise SensorNetProxyError("Unknown unit system '{0}'. Known are '{1}'".format(
+                config, str(InternalResponder.UNITS)))
+        self._allocator = allocator
+        self._config = config
+        self._clock = clock
+        # internal type -> number of responses
+        self.responses = {}
+
+    def handle(self, msg, assign_id=True):
+        """
+        Return the response to the message or None if it should be forwarded to controllers
+
+        :param msg: MySensorsMsg received from a gateway
+        :param assign_id: whether to answer ID requests
+        """
+        self._allocator.observe(msg.node_id)
+        if msg.message_type != MySensorsMsg.MSG_TYPE_INTERNAL:
+            return None
+
+        if msg.sub_type == MySensorsMsg.INTERNAL_TYPE_TIME:
+            # nodes expect the local time
+            payload = str(calendar.timegm(time.localtime(self._clock())))
+            sub_type = MySensorsMsg.INTERNAL_TYPE_TIME
+        elif msg.sub_type == MySensorsMsg.INTERNAL_TYPE_CONFIG:
+            payload = self._config
+            sub_type = MySensorsMsg.INTERNAL_TYPE_CONFIG
+        elif msg.sub_type == MySensorsMsg.INTERNAL_TYPE_ID_REQUEST and assign_id:
+            node_id = self._allocator.allocate()
+            if node_id is None:
+                logger.warning('All node IDs are used, leaving the ID request to controllers')
+                return None
+            logger.info("Assigned node ID {0}".format(node_id))
+            payload = str(node_id)
+            sub_type = MySensorsMsg.INTERNAL_TYPE_ID_RESPONSE
+        else:
+            return None
+
+        self.responses[msg.sub_type] = self.responses.get(msg.sub_type, 0) + 1
+        return MySensorsMsg(msg.node_id, msg.child_sensor_id, MySensorsMsg.MSG_TYPE_INTERNAL, 0, sub_type, payload)
+
+    def save(self):
+        self._allocator.save()
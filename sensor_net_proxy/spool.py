@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Append-only log of published messages stored in memory mapped segment files.
+
+Every published message gets a sequential offset. The log is split into segments named
+after the offset of their first message. The active segment is preallocated and memory
+mapped, so appending a message is a copy into memory. The mapping is synced to disk
+periodically, not per message. When the active segment is full, it is truncated to its
+used size and a new one is started. The oldest segments are deleted when there are more
+than the retention limit.
+
+Record format: marker byte, offset (8 bytes), topic length (2 bytes), body length (4 bytes),
+all in the network byte order, followed by the topic and the body.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+
+import zmq
+
+from sensor_net_proxy.encoding import make_offset
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger
+
+SEGMENT_SUFFIX = '.seg'
+# smallest allowed size of a segment in bytes
+MIN_SEGMENT_SIZE = 64 * 1024
+
+_HEADER = struct.Struct('!BQHI')
+_MARKER = 0xA5
+# number of records between entries of the sparse index of a segment
+_INDEX_INTERVAL = 256
+
+
+class _Segment(object):
+    """
+    Single segment file of the log
+    """
+
+    def __init__(self, directory, base_offset):
+        self.base_offset = base_offset
+        self.path = os.path.join(directory, '{0:020d}{1}'.format(base_offset, SEGMENT_SUFFIX))
+        self.next_offset = base_offset
+        # number of used bytes
+        self.size = 0
+        # sparse index, offsets and positions of every _INDEX_INTERVAL-th record
+        self._index_offsets = []
+        self._index_positions = []
+        self._indexed = False
+        self._file = None
+        self._mmap = None
+
+    def create(self, capacity):
+        """
+        Create the preallocated segment file and map it for appending
+        """
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), capacity)
+        self._indexed = True
+
+    def recover(self):
+        """
+        Find the end of data in an existing segment file, e.g. after a crash, and truncate the file to it
+        """
+        with open(self.path, 'r+b') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._scan(buf)
+                finally:
+                    buf.close()
+            f.truncate(self.size)
+
+    def _scan(self, buf):
+        """
+        Build the index and find the end of data of the segment
+        """
+        self._index_offsets = []
+        self._index_positions = []
+        pos = 0
+        offset = self.base_offset
+        end = len(buf)
+        while pos + _HEADER.size <= end:
+            marker, record_offset, topic_len, body_len = _HEADER.unpack_from(buf, pos)
+            next_pos = pos + _HEADER.size + topic_len + body_len
+            if marker != _MARKER or record_offset != offset or next_pos > end:
+                break
+            self._add_to_index(offset, pos)
+            pos = next_pos
+            offset += 1
+        self.size = pos
+        self.next_offset = offset
+        self._indexed = True
+
+    def _add_to_index(self, offset, pos):
+        if (offset - self.base_offset) % _INDEX_INTERVAL == 0:
+            self._index_offsets.append(offset)
+            self._index_positions.append(pos)
+
+    def append(self, topic, body):
+        """
+        Append the record to the mapped segment
+
+        :return: False if the segment is full
+        """
+        pos = self.size
+        end = pos + _HEADER.size + len(topic) + len(body)
+        if end > len(self._mmap):
+            return False
+        buf = self._mmap
+        start = pos + _HEADER.size
+        buf[start:start + len(topic)] = topic
+        buf[start + len(topic):end] = body
+        # the header is written last, so a torn record is not recognized as valid
+        _HEADER.pack_into(buf, pos, _MARKER, self.next_offset, len(topic), len(body))
+        self._add_to_index(self.next_offset, pos)
+        self.size = end
+        self.next_offset += 1
+        return True
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def seal(self):
+        """
+        Sync the mapped segment and truncate it to the used size
+        """
+        self._mmap.flush()
+        self._mmap.close()
+        self._mmap = None
+        self._file.truncate(self.size)
+        self._file.close()
+        self._file = None
+
+    def read(self, offset, max_count):
+        """
+        Return list of (offset, topic, body) tuples of at most max_count records starting with the offset
+        """
+        if self._mmap is not None:
+            return self._read_from(self._mmap, offset, max_count)
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if not self._indexed:
+                    self._scan(buf)
+                return self._read_from(buf, offset, max_count)
+            finally:
+                buf.close()
+
+    def _read_from(self, buf, offset, max_count):
+        index = bisect.bisect_right(self._index_offsets, offset) - 1
+        if index < 0:
+            return []
+        pos = self._index_positions[index]
+        current = self._index_offsets[index]
+        records = []
+        while pos < self.size and len(records) < max_count:
+            _, record_offset, topic_len, body_len = _HEADER.unpack_from(buf, pos)
+            start = pos + _HEADER.size
+            pos = start + topic_len + body_len
+            if current >= offset:
+                records.append((record_offset, buf[start:start + topic_len], buf[start + topic_len:pos]))
+            current += 1
+        return records
+
+    def delete(self):
+        os.unlink(self.path)
+
+
+class SegmentLog(object):
+    """
+    Append-only log of (topic, body) records with sequential offsets. All methods are thread safe.
+    """
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, retention=16):
+        """
+        :param directory: directory with the segment files, created if it does not exist
+        :param segment_size: size of a segment file in bytes
+        :param retention: maximum number of kept segments including the active one
+        """
+        if segment_size < MIN_SEGMENT_SIZE:
+            raise SensorNetProxyError("Spool segment size must be at least {0} bytes".format(MIN_SEGMENT_SIZE))
+        if retention < 1:
+            raise SensorNetProxyError("Spool retention must be at least 1 segment")
+        self._directory = directory
+        self._segment_size = segment_size
+        self._retention = retention
+        self._lock = threading.Lock()
+        # number of records which did not fit into an empty segment
+        self.dropped = 0
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._segments = []
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(SEGMENT_SUFFIX):
+                    self._segments.append(_Segment(directory, int(name[:-len(SEGMENT_SUFFIX)])))
+            next_offset = 0
+            if self._segments:
+                last = self._segments[-1]
+                last.recover()
+                next_offset = last.next_offset
+                logger.info("Spool in '{0}' recovered, next offset is {1}".format(directory, next_offset))
+            self._start_segment(next_offset)
+        except (IOError, OSError, ValueError) as e:
+            raise SensorNetProxyError("Can not open spool in '{0}': {1}".format(directory, e))
+
+    def _start_segment(self, base_offset):
+        if self._segments and self._segments[-1].base_offset == base_offset:
+            # the last segment is empty, reuse its name
+            self._segments.pop()
+        segment = _Segment(self._directory, base_offset)
+        segment.create(self._segment_size)
+        self._segments.append(segment)
+        self._active = segment
+
+        while len(self._segments) > self._retention:
+            oldest = self._segments.pop(0)
+            logger.debug("Deleting spool segment '{0}'".format(oldest.path))
+            oldest.delete()
+
+    def append(self, topic, body):
+        """
+        Append the record to the log
+
+        :return: offset of the record or None if it is bigger than a segment and was dropped
+        """
+        with self._lock:
+            offset = self._active.next_offset
+            if self._active.append(topic, body):
+                return offset
+            if self._active.size == 0:
+                self.dropped += 1
+                return None
+            self._active.seal()
+            self._start_segment(self._active.next_offset)
+            self._active.append(topic, body)
+            return offset
+
+    def flush(self):
+        """
+        Sync appended records to the disk
+        """
+        with self._lock:
+            self._active.flush()
+
+    @property
+    def first_offset(self):
+        return self._segments[0].base_offset
+
+    @property
+    def next_offset(self):
+        return self._active.next_offset
+
+    def read(self, offset, max_count):
+        """
+        Read records starting with the offset. If the offset is no longer retained,
+        reading starts with the first retained record.
+
+        :return: list of at most max_count (offset, topic, body) tuples
+        """
+        with self._lock:
+            offset = max(offset, self.first_offset)
+            index = bisect.bisect_right([s.base_offset for s in self._segments], offset) - 1
+            records = []
+            for segment in self._segments[index:]:
+                if len(records) >= max_count:
+                    break
+                records.extend(segment.read(max(offset, segment.base_offset), max_count - len(records)))
+            return records
+
+    def close(self):
+        with self._lock:
+            self._active.seal()
+
+
+class ReplayServer(object):
+    """
+    REP socket serving records of the spool to consumers resuming from an offset.
+
+    The request consists of a frame with the offset of the first requested record and an optional
+    frame with the maximum number of records, both as decimal numbers. The reply starts with frames
+    with the first retained offset and the offset following the last record in the log as decimal
+    numbers, followed by topic, offset and message frames of each record, the same as published
+    messages. See encoding.decode_replay().
+    """
+
+    def __init__(self, zmq_ctx, endpoint, spool, batch_size=1000):
+        """
+        :param zmq_ctx: ZMQ context
+        :param endpoint: endpoint to bind the socket to
+        :param spool: SegmentLog
+        :param batch_size: maximum number of records in a reply
+        """
+        self._spool = spool
+        self._batch_size = batch_size
+        self._socket = zmq_ctx.socket(zmq.REP)
+        try:
+            self._socket.bind(endpoint)
+        except zmq.ZMQError as e:
+            self._socket.close()
+            raise SensorNetProxyError("Can not create replay socket on '{0}': {1}".format(endpoint, e))
+
+    def get_sockets(self):
+        return [self._socket]
+
+    def handle_requests(self, sock):
+        """
+        Reply to all queued replay requests
+        """
+        while True:
+            try:
+                frames = sock.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            try:
+                offset = int(frames[0])
+                count = min(int(frames[1]), self._batch_size) if len(frames) > 1 else self._batch_size
+            except (IndexError, ValueError):
+                logger.warning("Malformed replay request '{0}'".format(frames))
+                offset, count = 0, 0
+
+            records = self._spool.read(offset, count) if count > 0 else []
+            logger.debug("Replaying {0} messages from offset {1}".format(len(records), offset))
+            reply = [str(self._spool.first_offset).encode('ascii'), str(self._spool.next_offset).encode('ascii')]
+            for record_offset, topic, body in records:
+                reply.append(topic)
+                reply.append(make_offset(record_offset))
+                reply.append(body)
+            sock.send_multipart(reply)
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Modular sensors network <-> controller proxy
+# Copyright (C) 2014-2015  Tomas Hozza <thozza@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import signal
+import tempfile
+import threading
+
+import zmq
+
+from sensor_net_proxy.application import Application
+from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.logger import logger, LoggerHelper, logging
+from sensor_net_proxy.zmq_proxy import publisher_socket_options, setup_publisher_socket
+
+
+class WorkerPool(object):
+    """
+    Runs the proxy in multiple worker processes.
+
+    Each worker binds its own listening sockets with SO_REUSEPORT, so the kernel spreads
+    the incoming datagrams across them. Workers publish messages to a XSUB/XPUB forwarder
+    running in the parent process, which binds the public publisher endpoint.
+
+    Only the worker 0 handles dynamic discovery and commands from controllers, so the
+    registry of gateways is kept in a single process.
+    """
+
+    def __init__(self, cli_conf, workers):
+        """
+        :param cli_conf: ArgsParser object with configuration gathered from commandline
+        :param workers: number of worker processes
+        """
+        if workers < 1:
+            raise SensorNetProxyError("Number of workers must be at least 1")
+        if cli_conf.snapshot_endpoint:
+            raise SensorNetProxyError("Serving snapshots is not supported with multiple workers, "
+                                      "each worker sees only a part of the messages")
+        if cli_conf.spool_dir:
+            raise SensorNetProxyError("Spooling is not supported with multiple workers, "
+                                      "each worker sees only a part of the messages")
+        if cli_conf.local_responder:
+            raise SensorNetProxyError("Answering internal requests is not supported with multiple workers, "
+                                      "node IDs would be assigned by each worker independently")
+        if cli_conf.capture_file or cli_conf.replay_capture:
+            raise SensorNetProxyError("Capturing and replaying datagrams is not supported with multiple workers")
+        self._conf = cli_conf
+        self._workers = workers
+        self._pids = {}
+        self._forwarder_endpoint = 'ipc://{0}'.format(
+            os.path.join(tempfile.gettempdir(), 'sensor-net-proxy-{0}.ipc'.format(os.getpid())))
+
+    def run(self):
+        # fork before creating any ZMQ context, it must not be shared with the workers
+        for worker_id in range(self._workers):
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker(worker_id)
+            self._pids[pid] = worker_id
+
+        if self._conf.verbose:
+            LoggerHelper.add_stream_handler(logger, logging.DEBUG)
+        else:
+            LoggerHelper.add_stream_handler(logger, logging.INFO)
+        logger.info('Sensor Net Proxy started {0} workers'.format(self._workers))
+
+        # stop the workers also when the parent is terminated
+        signal.signal(signal.SIGTERM, WorkerPool._handle_sigterm)
+        try:
+            self._start_forwarder()
+            pid, status = os.wait()
+            worker_id = self._pids.pop(pid)
+            raise SensorNetProxyError("Worker {0} exited with status {1}".format(
+                worker_id, os.waitstatus_to_exitcode(status)))
+        finally:
+            self._stop_workers()
+            try:
+                os.unlink(self._forwarder_endpoint[len('ipc://'):])
+            except OSError:
+                pass
+
+    @staticmethod
+    def _handle_sigterm(signum, frame):
+        raise SystemExit(0)
+
+    def _start_forwarder(self):
+        """
+        Start thread forwarding messages published by the workers to the subscribers
+        """
+        conf = self._conf
+        zmq_ctx = zmq.Context(conf.zmq_io_threads)
+        xsub = zmq_ctx.socket(zmq.XSUB)
+        xpub = zmq_ctx.socket(zmq.XPUB)
+        try:
+            xsub.bind(self._forwarder_endpoint)
+        except zmq.ZMQError as e:
+            raise SensorNetProxyError("Can not create the workers' forwarder: {0}".format(e))
+        # subscribers connect to the forwarder, so it gets the publisher options
+        setup_publisher_socket(xpub, conf.zmq_publish_endpoints, publisher_socket_options(
+            conf.zmq_sndhwm, conf.zmq_sndbuf, conf.zmq_tcp_keepalive, conf.zmq_tcp_keepalive_idle,
+            conf.zmq_tcp_keepalive_interval, conf.zmq_conflate))
+
+        # the sockets are used only by the forwarder thread from now on
+        forwarder = threading.Thread(target=zmq.proxy, args=(xsub, xpub), name='forwarder')
+        forwarder.daemon = True
+        forwarder.start()
+
+    def _run_worker(self, worker_id):
+        """
+        Run the application in the forked worker process. Never returns.
+        """
+        status = 0
+        try:
+            app = Application(self._conf, worker_id, self._forwarder_endpoint)
+            app.run()
+        except KeyboardInterrupt:
+            pass
+        except SensorNetProxyError as e:
+            logger.error('\nWorker {0}: {1}'.format(worker_id, e))
+            status = 1
+        except BaseException:
+            logger.exception('Worker {0} failed'.format(worker_id))
+            status = 1
+        # atexit handlers are not run by os._exit()
+        LoggerHelper.stop_listeners()
+        os._exit(status)
+
+    def _stop_workers(self):
+        for pid in self._pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self._pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._pids.clear()
@@ -19,8 +19,61 @@
 
 import zmq
 
+from sensor_net_proxy.encoding import get_encoding, make_offset, make_topic, decode_multipart
 from sensor_net_proxy.logger import logger
-from sensor_net_proxy.exceptions import SensorNetProxyError
+from sensor_net_proxy.exceptions import MalformedMsgError, SensorNetProxyError
+from sensor_net_proxy.my_sensors import MySensorsMsg
+
+
+def publisher_socket_options(sndhwm=None, sndbuf=None, tcp_keepalive=False, tcp_keepalive_idle=None,
+                             tcp_keepalive_interval=None, conflate=False):
+    """
+    Return list of (option, value) tuples for the publisher socket. Options which are None are left
+    at the ZMQ defaults.
+
+    :param sndhwm: maximum number of messages queued for a single subscriber
+    :param sndbuf: size of the kernel send buffer in bytes
+    :param tcp_keepalive: whether to turn on TCP keepalive
+    :param tcp_keepalive_idle: number of idle seconds before the first keepalive probe
+    :param tcp_keepalive_interval: number of seconds between keepalive probes
+    :param conflate: whether to keep only the last message queued for a subscriber
+    """
+    options = []
+    if sndhwm is not None:
+        options.append((zmq.SNDHWM, sndhwm))
+    if sndbuf is not None:
+        options.append((zmq.SNDBUF, sndbuf))
+    if tcp_keepalive:
+        options.append((zmq.TCP_KEEPALIVE, 1))
+        if tcp_keepalive_idle is not None:
+            options.append((zmq.TCP_KEEPALIVE_IDLE, tcp_keepalive_idle))
+        if tcp_keepalive_interval is not None:
+            options.append((zmq.TCP_KEEPALIVE_INTVL, tcp_keepalive_interval))
+    if conflate:
+        options.append((zmq.CONFLATE, 1))
+    return options
+
+
+def setup_publisher_socket(sock, endpoints, options=(), connect=False):
+    """
+    Set the options of the publisher socket and bind it to all endpoints
+
+    :param connect: whether to connect the socket to the endpoints instead of binding
+    """
+    try:
+        for option, value in options:
+            sock.setsockopt(option, value)
+    except zmq.ZMQError as e:
+        raise SensorNetProxyError("Can not set publisher socket options: {0}".format(e))
+    for endpoint in endpoints:
+        logger.debug("{0} publisher socket to '{1}'".format('Connecting' if connect else 'Binding', endpoint))
+        try:
+            if connect:
+                sock.connect(endpoint)
+            else:
+                sock.bind(endpoint)
+        except zmq.ZMQError as e:
+            raise SensorNetProxyError("Can not create publisher socket on '{0}': {1}".format(endpoint, e))
 
 
 class ZmqProxy(object):
@@ -28,14 +81,80 @@ class ZmqProxy(object):
     Class representing ZMQ I/O process
     """
 
-    def __init__(self):
-        self._zmq_ctx = zmq.Context()
+    COMMAND_SOCKET_TYPES = ('sub', 'pull')
+    DEFAULT_PUBLISH_ENDPOINT = 'tcp://*:5556'
+
+    def __init__(self, encoding='json', topic=True, command_endpoint=None, command_socket_type='sub',
+                 command_batch_size=64, publish_endpoints=(DEFAULT_PUBLISH_ENDPOINT,), publish_connect=False,
+                 spool=None, io_threads=1, publish_options=(), check_sub_type=True):
+        """
+        :param encoding: name of the wire format of published and received messages
+        :param topic: whether to publish messages with the topic frame
+        :param command_endpoint: endpoint of the socket receiving messages for the gateways, or None
+        :param command_socket_type: 'sub' to connect to the controller's PUB socket,
+                                    'pull' to bind and receive from controllers' PUSH sockets
+        :param command_batch_size: maximum number of commands received at once
+        :param publish_endpoints: list of endpoints of the publisher socket
+        :param publish_connect: whether to connect the publisher socket to the endpoints instead of binding
+        :param spool: SegmentLog to which all published messages are appended, or None
+        :param io_threads: number of ZMQ I/O threads
+        :param publish_options: list of (option, value) tuples set on the publisher socket,
+                                see publisher_socket_options()
+        :param check_sub_type: whether to drop commands with sub-type not known for the message type
+        """
+        if (zmq.CONFLATE, 1) in publish_options and topic:
+            raise SensorNetProxyError("Conflating messages requires publishing without the topic frame, "
+                                      "ZMQ does not conflate multipart messages")
+        self._encoding = get_encoding(encoding)
+        self._topic = topic
+        self._command_batch_size = command_batch_size
+        self._spool = spool
+        self._check_sub_type = check_sub_type
+        self._zmq_ctx = zmq.Context(io_threads)
+        # statistics
+        self.published = 0
+        self.bytes_published = 0
+        self.commands_received = 0
+        self.commands_malformed = 0
         # publisher socket
         self._publisher_socket = self._zmq_ctx.socket(zmq.PUB)
-        self._publisher_socket.bind('tcp://*:5556')
+        setup_publisher_socket(self._publisher_socket, publish_endpoints, publish_options, publish_connect)
         # subscriber socket
-        #self._subscriber_socket = self._zmq_ctx.socket(zmq.SUB)
-        #self._subscriber_socket.connect()
+        self._subscriber_socket = None
+        if command_endpoint:
+            self._subscriber_socket = self._create_command_socket(command_endpoint, command_socket_type)
+
+    def _create_command_socket(self, endpoint, socket_type):
+        """
+        Create socket for receiving messages from controllers
+        """
+        logger.debug("Creating '{0}' command socket on '{1}'".format(socket_type, endpoint))
+        try:
+            if socket_type == 'sub':
+                sock = self._zmq_ctx.socket(zmq.SUB)
+                sock.setsockopt(zmq.SUBSCRIBE, b'')
+                sock.connect(endpoint)
+            elif socket_type == 'pull':
+                sock = self._zmq_ctx.socket(zmq.PULL)
+                sock.bind(endpoint)
+            else:
+                raise SensorNetProxyError("Unknown command socket type '{0}'. Known types are '{1}'".format(
+                    socket_type, str(ZmqProxy.COMMAND_SOCKET_TYPES)))
+        except zmq.ZMQError as e:
+            raise SensorNetProxyError("Can not create command socket on '{0}': {1}".format(endpoint, e))
+        return sock
+
+    @property
+    def context(self):
+        return self._zmq_ctx
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    @property
+    def command_batch_size(self):
+        return self._command_batch_size
 
     def publish(self, msg):
         """
@@ -45,23 +164,61 @@ class ZmqProxy(object):
         :return:
         """
         # TODO: log message
-        self._publisher_socket.send_json(msg.__dict__)
+        data = self._encoding.encode(msg)
+        if self._spool is not None:
+            topic = make_topic(msg)
+            offset = make_offset(self._spool.append(topic, data))
+            if self._topic:
+                self._publisher_socket.send_multipart((topic, offset, data))
+            else:
+                self._publisher_socket.send_multipart((offset, data))
+        elif self._topic:
+            self._publisher_socket.send_multipart((make_topic(msg), data))
+        else:
+            self._publisher_socket.send(data)
+        self.published += 1
+        self.bytes_published += len(data)
 
     def handle_incoming_msg(self, sock):
         """
-        Handle incoming message on ZMQ socket.
+        Handle incoming messages on ZMQ socket.
+
+        The socket's FD is edge triggered, so the caller must call this method again
+        as long as it returns full batches.
+
+        :return: list of MySensorsMsg, at most command_batch_size long
         """
-        pass
+        msgs = []
+        while len(msgs) < self._command_batch_size:
+            try:
+                frames = sock.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            self.commands_received += 1
+            try:
+                msg = MySensorsMsg(**decode_multipart(self._encoding.name, frames))
+                msg.check_fields(self._check_sub_type)
+                # a new line would start another message for the gateway
+                if '\n' in msg.payload:
+                    raise MalformedMsgError('payload')
+                msgs.append(msg)
+            except (ValueError, TypeError, KeyError) as e:
+                self.commands_malformed += 1
+                logger.warning("Dropping malformed command '{0}': {1}".format(frames, e))
+        return msgs
 
     def get_sockets(self):
         """
         Return sockets on which we can expect incoming messages
         """
+        if self._subscriber_socket is None:
+            return []
         return [self._subscriber_socket]
 
     def close_sockets(self):
         self._publisher_socket.close()
-        #self._subscriber_socket.close()
+        if self._subscriber_socket is not None:
+            self._subscriber_socket.close()
 
     def is_zmq_socket(self, sock):
-        return self._subscriber_socket == sock
\ No newline at end of file
+        return self._subscriber_socket == sock